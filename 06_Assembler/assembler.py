@@ -1,3 +1,15 @@
+import argparse
+import json
+import os
+import sys
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from glob import glob
+from itertools import permutations
+
+TOOLS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'tools')
+
 
 class Parser:
     """
@@ -64,122 +76,101 @@ class Parser:
                     self.comp, self.jmp = line.split(';')
 
 
+def _build_comp_codes():
+    # a=0 codes, written with A register.
+    codes = {
+        '0': 0b0101010,
+        '1': 0b0111111,
+        '-1': 0b0111010,
+        'D': 0b0001100,
+        'A': 0b0110000,
+        '!D': 0b0001101,
+        '!A': 0b0110001,
+        '-D': 0b0001111,
+        '-A': 0b0110011,
+        'D+1': 0b0011111,
+        'A+1': 0b0110111,
+        'D-1': 0b0001110,
+        'A-1': 0b0110010,
+        'D+A': 0b0000010,
+        'A+D': 0b0000010,
+        'D-A': 0b0010011,
+        'A-D': 0b0000111,
+        'D&A': 0b0000000,
+        'D|A': 0b0010101,
+    }
+    # a=1 codes: same computation with M instead of A.
+    for comp, code in list(codes.items()):
+        if 'A' in comp:
+            codes[comp.replace('A', 'M')] = code | 0b1000000
+    return codes
+
+
+def _build_dest_codes():
+    codes = {None: 0b000}
+    for dest, code in (('M', 0b001), ('D', 0b010), ('MD', 0b011), ('A', 0b100),
+                       ('AM', 0b101), ('AD', 0b110), ('AMD', 0b111)):
+        for perm in set(permutations(dest)):
+            codes[''.join(perm)] = code
+    return codes
+
+
 class Translator:
     """
     Translate one assembly line into (mostly one line of) binary code.
+    Every field is looked up from precomputed tables, instructions are encoded as 16 bit integers.
     """
-    @staticmethod
-    def _convert_to_binary(dec_val):
-        return bin(int(dec_val))[2:]
+    COMP_CODES = _build_comp_codes()
+    DEST_CODES = _build_dest_codes()
+    JMP_CODES = {
+        None: 0b000,
+        'JGT': 0b001,
+        'JEQ': 0b010,
+        'JGE': 0b011,
+        'JLT': 0b100,
+        'JNE': 0b101,
+        'JLE': 0b110,
+        'JMP': 0b111,
+    }
+    C_INSTRUCTION_PREFIX = 0b111 << 13
 
     @staticmethod
-    def _translate_dest(dest):
-        if dest is None:
-            return '000'
-        elif dest == 'M':
-            return '001'
-        elif dest == 'D':
-            return '010'
-        elif dest == 'MD' or dest == 'DM':
-            return '011'
-        elif dest == 'A':
-            return '100'
-        elif dest == 'AM' or dest == 'MA':
-            return '101'
-        elif dest == 'AD' or dest == 'DA':
-            return '110'
-        else:  # dest == 'AMD"
-            return '111'
+    def to_binary_string(word):
+        return format(word, '016b')
 
-    @staticmethod
-    def _translate_comp(comp):
-        output = ''
-        if 'M' in comp:
-            output += '1'
-            comp = comp.replace('M', 'A')
-        else:
-            output += '0'
-
-        if comp == '0':
-            output += '101010'
-        elif comp == '1':
-            output += '111111'
-        elif comp == '-1':
-            output += '111010'
-        elif comp == 'D':
-            output += '001100'
-        elif comp == 'A':
-            output += '110000'
-        elif comp == '!D':
-            output += '001101'
-        elif comp == '!A':
-            output += '110001'
-        elif comp == '-D':
-            output += '001111'
-        elif comp == '-A':
-            output += '110011'
-        elif comp == 'D+1':
-            output += '011111'
-        elif comp == 'A+1':
-            output += '110111'
-        elif comp == 'D-1':
-            output += '001110'
-        elif comp == 'A-1':
-            output += '110010'
-        elif comp == 'D+A' or comp == 'A+D':
-            output += '000010'
-        elif comp == 'D-A':
-            output += '010011'
-        elif comp == 'A-D':
-            output += '000111'
-        elif comp == 'D&A':
-            output += '000000'
-        elif comp == 'D|A':
-            output += '010101'
-        else:
-            raise NotImplementedError('Comp command not implemented.')
-        return output
+    def encode_a_instruction(self, value):
+        value = int(value)
+        assert 0 <= value < (1 << 15)
+        return value
 
-    @staticmethod
-    def _translate_jmp(jmp):
-        if jmp is None:
-            return '000'
-        elif jmp == 'JGT':
-            return '001'
-        elif jmp == 'JEQ':
-            return '010'
-        elif jmp == 'JGE':
-            return '011'
-        elif jmp == 'JLT':
-            return '100'
-        elif jmp == 'JNE':
-            return '101'
-        elif jmp == 'JLE':
-            return '110'
-        elif jmp == 'JMP':
-            return '111'
-        else:
+    def encode_c_instruction(self, dest, comp, jmp):
+        try:
+            comp_code = self.COMP_CODES[comp]
+        except KeyError:
+            raise NotImplementedError('Comp command not implemented.')
+        try:
+            dest_code = self.DEST_CODES[dest]
+        except KeyError:
+            raise NotImplementedError('Dest command not implemented.')
+        try:
+            jmp_code = self.JMP_CODES[jmp]
+        except KeyError:
             raise NotImplementedError('JMP command not implemented.')
+        return self.C_INSTRUCTION_PREFIX | (comp_code << 6) | (dest_code << 3) | jmp_code
+
+    def encode_parsed_line(self, instruction_type, value, dest, comp, jmp):
+        if instruction_type == 'a':
+            return self.encode_a_instruction(value)
+        return self.encode_c_instruction(dest, comp, jmp)
 
     def translate_a_instruction(self, value):
-        output = ''
-        bin_val = self._convert_to_binary(value)
-        bin_len = len(bin_val)
-        assert bin_len <= 15
-        output += '0' * (16 - bin_len) + bin_val
-        return output
+        return self.to_binary_string(self.encode_a_instruction(value))
 
     def translate_c_intruction(self, dest, comp, jmp):
-        output = '111'
-        output += self._translate_comp(comp)
-        output += self._translate_dest(dest)
-        output += self._translate_jmp(jmp)
-        return output
+        return self.to_binary_string(self.encode_c_instruction(dest, comp, jmp))
 
     def translate_parsed_line(self, instruction_type, value, dest, comp, jmp):
-        if instruction_type == 'a':
-            return self.translate_a_instruction(value)
-        return self.translate_c_intruction(dest, comp, jmp)
+        return self.to_binary_string(self.encode_parsed_line(instruction_type, value, dest, comp, jmp))
 
 
 class SymbolManager:
@@ -256,10 +247,228 @@ class Assembler:
     def _reset_current_line(self):
         self.current_address = 0
 
-    def translate(self, input_path, output_path):
+    def translate(self, input_path, output_path, single_pass=False, binary_output_path=None, cache=None,
+                  source_map_path=None):
+        """
+        Write text .hack to output_path.
+        If binary_output_path is given, also write a packed little-endian uint16 ROM image there.
+        If source_map_path is given, also write the source map there (see build_source_map).
+        If cache (BuildCache) is given, unchanged inputs are copied from the cache instead of assembled.
+        """
+        output_paths = [path for path in (output_path, binary_output_path, source_map_path) if path is not None]
+        if cache is not None:
+            options = {'binary': binary_output_path is not None, 'source_map': source_map_path is not None}
+            key = cache.make_key(__file__, [input_path], options)
+            if cache.get(key, output_paths):
+                return
+
+        if single_pass:
+            words = self._assemble_single_pass(input_path)
+            self._write_text(words, output_path)
+        else:
+            words = self._assemble_two_pass(input_path, output_path, keep_words=binary_output_path is not None)
+        if binary_output_path is not None:
+            self._write_binary(words, binary_output_path)
+        if source_map_path is not None:
+            with open(input_path, 'r') as rf:
+                self.write_source_map(self.build_source_map(rf), source_map_path)
+        if cache is not None:
+            cache.put(key, output_paths)
+
+    @staticmethod
+    def iter_words(lines, symbol_manager=None, source_map=None):
+        """
+        Streaming api: any iterable of assembly lines in, (address, word) pairs out.
+
+        Instructions are yielded as soon as they can be encoded.
+        An A-instruction whose symbol is not known yet is held back as its address only,
+        and yielded once the label is defined, or at the end of the stream as a variable.
+        So only forward references come out of address order.
+        If source_map (see build_source_map) is given, it is filled in along the way.
+        """
+        parser = Parser()
+        translator = Translator()
+        if symbol_manager is None:
+            symbol_manager = SymbolManager()
+        symbol_table = symbol_manager.symbol_table
+        pending = {}
+        address = 0
+
+        for line_number, line in enumerate(lines, 1):
+            parser.parse_line(line)
+            if source_map is not None:
+                if parser.instruction_type == 'label':
+                    source_map['labels'][parser.label.strip('()')] = address
+                elif parser.instruction_type in ('a', 'c'):
+                    source_map['lines'].append([line_number, address])
+            if parser.instruction_type == 'label':
+                symbol_manager.map_label_to_instruction_address(parser.label, address)
+                for pending_address in pending.pop(parser.label.strip('()'), ()):
+                    yield pending_address, translator.encode_a_instruction(address)
+            elif parser.instruction_type == 'a':
+                value = parser.value
+                if not symbol_manager.is_int(value):
+                    if value not in symbol_table:
+                        pending.setdefault(value, []).append(address)
+                        address += 1
+                        continue
+                    value = symbol_table[value]
+                yield address, translator.encode_a_instruction(value)
+                address += 1
+            elif parser.instruction_type == 'c':
+                yield address, translator.encode_c_instruction(parser.dest, parser.comp, parser.jmp)
+                address += 1
+
+        # whatever is left is a variable, allocated in order of first appearance.
+        for symbol, addresses in pending.items():
+            word = translator.encode_a_instruction(symbol_manager.convert_symbol(symbol))
+            for pending_address in addresses:
+                yield pending_address, word
+
+    def translate_lines(self, lines, output_path, binary_output_path=None, source_map_path=None):
+        """
+        Assemble from any iterable of lines without reading a file.
+        Either output can be None to skip it.
+        Every .hack line (and binary word) has fixed width,
+        so held back forward references are patched in place by seeking.
+        """
+        source_map = None if source_map_path is None else self.new_source_map()
+        with ExitStack() as stack:
+            outputs = []
+            if output_path is not None:
+                outputs.append((stack.enter_context(open(output_path, 'wb')), self._encode_text_word, 17))
+            if binary_output_path is not None:
+                outputs.append((stack.enter_context(open(binary_output_path, 'wb')), self._encode_binary_word, 2))
+
+            written_end = 0
+            for address, word in self.iter_words(lines, source_map=source_map):
+                for wf, encode, width in outputs:
+                    if address < written_end:
+                        wf.seek(address * width)
+                        wf.write(encode(word))
+                        wf.seek(written_end * width)
+                    else:
+                        # leave a placeholder for held back addresses.
+                        wf.write(encode(0) * (address - written_end) + encode(word))
+                written_end = max(written_end, address + 1)
+        if source_map is not None:
+            self.write_source_map(source_map, source_map_path)
+
+    @staticmethod
+    def new_source_map():
+        return {'lines': [], 'labels': {}}
+
+    @classmethod
+    def build_source_map(cls, lines):
+        """
+        {'lines': [[asm line number, ROM address], ...] for every instruction, 'labels': {label: ROM address}}
+        Line numbers start at 1.
+        """
+        source_map = cls.new_source_map()
+        for _ in cls.iter_words(lines, source_map=source_map):
+            pass
+        return source_map
+
+    @staticmethod
+    def write_source_map(source_map, path):
+        with open(path, 'w') as wf:
+            json.dump(source_map, wf)
+
+    @staticmethod
+    def _encode_text_word(word):
+        return (Translator.to_binary_string(word) + '\n').encode()
+
+    @staticmethod
+    def _encode_binary_word(word):
+        return word.to_bytes(2, 'little')
+
+    @staticmethod
+    def _tokenize(lines, symbol_manager):
+        """
+        Parse and encode every line in one go: the rules of Parser and Translator,
+        inlined into table lookups instead of method calls per line and field.
+        C-instructions are encoded once per distinct line.
+        Returns (words, fixups): A-instructions whose symbol is not known yet are left as 0,
+        their indices are collected in fixups for backpatching.
+        """
+        translator = Translator()
+        comp_codes, dest_codes, jmp_codes = Translator.COMP_CODES, Translator.DEST_CODES, Translator.JMP_CODES
+        prefix = Translator.C_INSTRUCTION_PREFIX
+        symbol_table = symbol_manager.symbol_table
+        c_words = {}
+        words = array('H')
+        fixups = {}
+        for line in lines:
+            line = line.split('/')[0].replace('\n', '').replace(' ', '')
+            if not line:
+                continue
+            if line[0] == '(':
+                symbol_manager.map_label_to_instruction_address(line, len(words))
+            elif line[0] == '@':
+                value = line[1:]
+                if value.isdigit() or symbol_manager.is_int(value):
+                    words.append(translator.encode_a_instruction(value))
+                elif value in symbol_table:
+                    words.append(translator.encode_a_instruction(symbol_table[value]))
+                else:
+                    fixups.setdefault(value, []).append(len(words))
+                    words.append(0)
+            else:
+                word = c_words.get(line)
+                if word is None:
+                    if '=' in line:
+                        dest, others = line.split('=')
+                        comp, jmp = others.split(';') if ';' in others else (others, None)
+                    elif ';' in line:
+                        dest = None
+                        comp, jmp = line.split(';')
+                    else:
+                        continue  # not an instruction, Parser leaves its type unset
+                    try:
+                        word = prefix | comp_codes[comp] << 6 | dest_codes[dest] << 3 | jmp_codes[jmp]
+                    except KeyError:
+                        word = translator.encode_c_instruction(dest, comp, jmp)  # raises for the bad field
+                    c_words[line] = word
+                words.append(word)
+        return words, fixups
+
+    @staticmethod
+    def _backpatch(words, fixups, symbol_manager):
+        # forward labels are in the table by now, anything else is a variable.
+        # fixups keeps first-appearance order, so variables get the same addresses as two pass mode.
+        translator = Translator()
+        for symbol, indices in fixups.items():
+            word = translator.encode_a_instruction(symbol_manager.convert_symbol(symbol))
+            for idx in indices:
+                words[idx] = word
+
+    @staticmethod
+    def _write_text(words, output_path):
+        with open(output_path, 'w') as wf:
+            wf.write(''.join([f'{word:016b}\n' for word in words]))
+
+    @staticmethod
+    def _write_binary(words, binary_output_path):
+        if sys.byteorder != 'little':
+            words = array('H', words)
+            words.byteswap()
+        with open(binary_output_path, 'wb') as wf:
+            words.tofile(wf)
+
+    def _assemble_single_pass(self, input_path):
+        symbol_manager = SymbolManager()
+        with open(input_path, 'r') as rf:
+            words, fixups = self._tokenize(rf, symbol_manager)
+        self._backpatch(words, fixups, symbol_manager)
+        return words
+
+    def _assemble_two_pass(self, input_path, output_path, keep_words=False):
+        # returns the words only if keep_words (for the binary output), None otherwise.
+        self._reset_current_line()
         parser = Parser()
         symbol_manager = SymbolManager()
         translator = Translator()
+        words = array('H') if keep_words else None
 
         # first path: deal with labels first.
         with open(input_path, 'r') as rf:
@@ -267,7 +476,7 @@ class Assembler:
                 parser.parse_line(line)
                 if parser.instruction_type == 'label':
                     symbol_manager.map_label_to_instruction_address(parser.label, self.current_address)
-                if parser.instruction_type != 'comment':
+                elif parser.instruction_type != 'comment':
                     self.current_address += 1
 
         # second path: deal with variable, and translate one by one.
@@ -279,7 +488,97 @@ class Assembler:
                     if parser.instruction_type not in ('label', 'comment'):
                         parser.label = symbol_manager.convert_symbol(parser.label)
                         parser.value = symbol_manager.convert_symbol(parser.value)
-                        translated = translator.translate_parsed_line(
+                        word = translator.encode_parsed_line(
                             parser.instruction_type, parser.value, parser.dest, parser.comp, parser.jmp
                         )
-                        wf.write(translated + '\n')
+                        if keep_words:
+                            words.append(word)
+                        wf.write(f'{word:016b}\n')
+        return words
+
+
+class BatchAssembler:
+    """
+    Assemble many .asm files over a process pool.
+    Each file gets its own Assembler (so its own SymbolManager),
+    results and errors are reported in sorted input path order regardless of scheduling.
+    """
+    def __init__(self, workers=None, single_pass=False, write_binary=False, cache=None, write_source_map=False):
+        self.workers = workers or os.cpu_count() or 1
+        self.single_pass = single_pass
+        self.write_binary = write_binary
+        self.cache = cache
+        self.write_source_map = write_source_map
+
+    @staticmethod
+    def expand_paths(dirs_or_globs):
+        paths = set()
+        for pattern in dirs_or_globs:
+            if os.path.isdir(pattern):
+                pattern = os.path.join(pattern, '*.asm')
+            paths.update(path for path in glob(pattern) if path.endswith('.asm'))
+        return sorted(paths)
+
+    @staticmethod
+    def _assemble_one(job):
+        input_path, single_pass, write_binary, cache, write_source_map = job
+        output_path = os.path.splitext(input_path)[0] + '.hack'
+        binary_output_path = os.path.splitext(input_path)[0] + '.bin' if write_binary else None
+        source_map_path = os.path.splitext(input_path)[0] + '.map.json' if write_source_map else None
+        try:
+            Assembler().translate(input_path, output_path, single_pass, binary_output_path, cache, source_map_path)
+        except Exception as e:
+            # don't leave half written outputs behind.
+            for path in (output_path, binary_output_path, source_map_path):
+                if path is not None and os.path.exists(path):
+                    os.remove(path)
+            return input_path, None, f'{type(e).__name__}: {e}'
+        return input_path, output_path, None
+
+    def assemble(self, dirs_or_globs):
+        """
+        Returns list of (input_path, output_path, error) in input path order.
+        """
+        jobs = [
+            (path, self.single_pass, self.write_binary, self.cache, self.write_source_map)
+            for path in self.expand_paths(dirs_or_globs)
+        ]
+        if self.workers == 1 or len(jobs) <= 1:
+            return [self._assemble_one(job) for job in jobs]
+
+        chunksize = max(1, len(jobs) // (self.workers * 4))
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            return list(executor.map(self._assemble_one, jobs, chunksize=chunksize))
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description='Assemble Hack .asm files into .hack files.')
+    arg_parser.add_argument('paths', nargs='+', help='.asm files, directories or glob patterns')
+    arg_parser.add_argument('-j', '--workers', type=int, default=None, help='number of processes (default: cpu count)')
+    arg_parser.add_argument('--single-pass', action='store_true', help='use single pass assembly')
+    arg_parser.add_argument('--binary', action='store_true', help='also write packed .bin ROM images')
+    arg_parser.add_argument('--cache-dir', default=None, help='reuse outputs of unchanged inputs from this build cache')
+    arg_parser.add_argument('--source-map', action='store_true', help='also write .map.json (asm line -> ROM address)')
+    args = arg_parser.parse_args(argv)
+
+    cache = None
+    if args.cache_dir:
+        # tools/ is only needed for the cache.
+        sys.path.append(TOOLS_DIR)
+        from build_cache import BuildCache
+        cache = BuildCache(args.cache_dir)
+    batch = BatchAssembler(args.workers, args.single_pass, args.binary, cache, args.source_map)
+    results = batch.assemble(args.paths)
+    n_failed = 0
+    for input_path, output_path, error in results:
+        if error is None:
+            print(f'{input_path} -> {output_path}')
+        else:
+            n_failed += 1
+            print(f'{input_path}: {error}', file=sys.stderr)
+    print(f'{len(results) - n_failed} assembled, {n_failed} failed')
+    return 1 if n_failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
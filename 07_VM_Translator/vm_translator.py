@@ -1,4 +1,6 @@
+import json
 import os
+from concurrent.futures import ProcessPoolExecutor
 from glob import glob
 
 
@@ -63,19 +65,77 @@ class Parser:
             else:
                 raise NotImplementedError(f'op_code {op_code} is not implemented')
 
+    def to_command(self):
+        """
+        Current line as a compact IR tuple (op_code, arg1, arg2). None for empty lines.
+            push / pop: (op_code, segment, index)
+            label / goto / if-goto: (op_code, label, None)
+            call / function: (op_code, function_name, n_args or n_lcls)
+            compute / return: (op_code, None, None)
+        """
+        if self.operation_type is None:
+            return None
+        if self.operation_type == 'memory':
+            return self.op_code, self.memory_segment, int(self.address)
+        if self.operation_type == 'branching':
+            return self.op_code, self.label, None
+        if self.operation_type == 'call':
+            return self.op_code, self.function_name, self.n_args
+        if self.operation_type == 'function':
+            return self.op_code, self.function_name, self.n_lcls
+        return self.op_code, None, None
+
+    def load_command(self, command):
+        # inverse of to_command: set attributes as if the command was parsed from a line.
+        self.parse_line(' '.join(str(arg) for arg in command if arg is not None))
+
 
 class Translator:
-    def __init__(self, add_annotation, include_bootstrapping=True):
+    """
+    shared_runtime: code size mode.
+        call, return and eq/gt/lt jump into one shared routine per program instead of being inlined.
+        Call sites pass their operands through registers:
+            call: R13 = n_args, R14 = function address, D = return address
+            eq/gt/lt: R15 = return address
+        Used routines are emitted by write_runtime(), after a halt loop at the end of the program.
+
+    stack_caching: top of the stack is kept in D across commands when possible.
+        While d_is_top_of_stack, the value in D is logically on the stack but not written to RAM yet,
+        so the next command consumes it without a spill / reload pair.
+        The cache is spilled before labels, goto, call, function, return and at the end of each file.
+
+    namespace_labels: generated labels (comparisons, return addresses) are prefixed with the file name,
+        and counted per file. So each file translates the same regardless of the files before it.
+    initialize: write bootstrapping / pointer initialization first.
+        Off for translators that only produce one file's chunk of a program.
+    """
+    RUNTIME_CALL = '$RUNTIME.CALL'
+    RUNTIME_RETURN = '$RUNTIME.RETURN'
+    RUNTIME_HALT = '$RUNTIME.HALT'
+
+    def __init__(self, add_annotation, include_bootstrapping=True, shared_runtime=False, stack_caching=False,
+                 namespace_labels=False, initialize=True):
         self.add_annotation = add_annotation
+        self.shared_runtime = shared_runtime
+        self.stack_caching = stack_caching
+        self.namespace_labels = namespace_labels
+        self.d_is_top_of_stack = False
+        self.used_runtime = []  # routine labels, in order of first use
         self.file_name = None
         self.label_counter = 0
+        self.label_prefix = ''
         self.segment_symbol_table = {
             'local': 'LCL',
             'argument': 'ARG',
             'this': 'THIS',
             'that': 'THAT'
         }
-        self.asm_output = ''
+        # emitted lines are buffered as chunks, and joined only when flushed.
+        self.asm_chunks = []
+        self.command_start = 0
+        self.lines_flushed = 0
+        if not initialize:
+            return
         if include_bootstrapping:
             self._initialize_program()
         else:
@@ -116,12 +176,15 @@ class Translator:
     def _increment_label_counter(self):
         self.label_counter += 1
 
+    def _unique_label(self, name):
+        return self.label_prefix + name
+
     def _write(self, line, indent=True):
         if indent:
             indent = '    '
         else:
             indent = ''
-        self.asm_output += indent + line + '\n'
+        self.asm_chunks.append(indent + line + '\n')
 
     def _op_m_decrement_stack_pointer(self):
         self._write('@SP')
@@ -138,20 +201,23 @@ class Translator:
     def _op_d_write_comp_branch(self, comp_type):
         assert comp_type in ('EQ', 'GT', 'LT')
 
+        true_label = self._unique_label(f'{comp_type}_{self.label_counter}')
+        end_label = self._unique_label(f'END_{comp_type}_{self.label_counter}')
+
         # compare and branching
         self._write('D=M-D')
-        self._write(f'@{comp_type}_{self.label_counter}')
+        self._write(f'@{true_label}')
         self._write(f'D;J{comp_type}')
 
         # set D=false
         self._write('D=0')
-        self._write(f'@END_{comp_type}_{self.label_counter}')
+        self._write(f'@{end_label}')
         self._write('0;JMP')
 
         # set D=true
-        self._write(f'({comp_type}_{self.label_counter})', indent=False)
+        self._write(f'({true_label})', indent=False)
         self._write('D=-1')
-        self._write(f'(END_{comp_type}_{self.label_counter})', indent=False)
+        self._write(f'({end_label})', indent=False)
 
         self._increment_label_counter()
 
@@ -285,8 +351,28 @@ class Translator:
         self._op_m_get_current_stack_value()
         self._write('D=M')
 
+    def use_runtime(self, labels):
+        for label in labels:
+            if label not in self.used_runtime:
+                self.used_runtime.append(label)
+
+    def _jump_to_runtime(self, label):
+        self.use_runtime([label])
+        self._jump_to_label(label)
+
+    def _get_runtime_writer(self, label):
+        if label == self.RUNTIME_CALL:
+            return self._write_runtime_call
+        if label == self.RUNTIME_RETURN:
+            return self._write_return
+        comp_type = label.split('.')[-1]
+        return lambda: self._write_runtime_comparison(comp_type)
+
     def _translate_call(self, fn_name, n_args):
-        return_label = f'{fn_name}.{self.label_counter}'
+        if self.shared_runtime:
+            self._translate_shared_call(fn_name, n_args)
+            return
+        return_label = self._unique_label(f'{fn_name}.{self.label_counter}')
         self._save_return_address(return_label)
         self._save_pointers()
         self._set_arg_pointer(n_args)
@@ -304,7 +390,25 @@ class Translator:
             self._op_write_d_to_current_stack_pointer()
             self._op_m_increment_stack_pointer()
 
+    def _translate_shared_call(self, fn_name, n_args):
+        return_label = self._unique_label(f'{fn_name}.{self.label_counter}')
+        self._op_d_set_value(n_args)
+        self._op_write_d_to_symbol_pointer('R13')
+        self._op_d_set_value(fn_name)
+        self._op_write_d_to_symbol_pointer('R14')
+        self._op_d_set_value(return_label)
+        self._jump_to_runtime(self.RUNTIME_CALL)
+
+        self._write(f'({return_label})', indent=False)
+        self._increment_label_counter()
+
     def _translate_return(self):
+        if self.shared_runtime:
+            self._jump_to_runtime(self.RUNTIME_RETURN)
+        else:
+            self._write_return()
+
+    def _write_return(self):
         # return value should be at top of the stack.
         # R13 = frame, R14 = return_address
         self._save_endframe_to_r13()
@@ -328,6 +432,14 @@ class Translator:
                 self._op_m_get_current_stack_value()
                 self._write('M=-M')
             self._op_m_increment_stack_pointer()
+        elif self.shared_runtime and operation in ('eq', 'gt', 'lt'):
+            comp_type = operation.upper()
+            return_label = self._unique_label(f'{comp_type}_{self.label_counter}')
+            self._op_d_set_value(return_label)
+            self._op_write_d_to_symbol_pointer('R15')
+            self._jump_to_runtime(f'$RUNTIME.{comp_type}')
+            self._write(f'({return_label})', indent=False)
+            self._increment_label_counter()
         else:  # two value operation
             # set target values into D, A
             self._op_m_decrement_stack_pointer()
@@ -401,7 +513,121 @@ class Translator:
         else:
             raise NotImplementedError(f'{operation} is not defined on branching operation')
 
+    def spill_top_of_stack(self):
+        # write cached top of stack value (D) onto the stack.
+        if self.d_is_top_of_stack:
+            self._op_write_d_to_current_stack_pointer()
+            self._op_m_increment_stack_pointer()
+            self.d_is_top_of_stack = False
+
+    def _op_d_get_top_of_stack(self):
+        # D = popped value, taken from the cache when it is there.
+        if self.d_is_top_of_stack:
+            self.d_is_top_of_stack = False
+        else:
+            self._op_d_pop_value()
+
+    def _op_write_d_to_memory_segment(self, memory_segment, address):
+        if memory_segment in self.segment_symbol_table:
+            segment_symbol = self.segment_symbol_table[memory_segment]
+            idx = int(address)
+            if idx <= 7:
+                # cheaper than computing the address through D.
+                self._write(f'@{segment_symbol}')
+                self._write('A=M')
+                for _ in range(idx):
+                    self._write('A=A+1')
+            else:
+                self._write('@R13')
+                self._write('M=D')
+                self._write(f'@{idx}')
+                self._write('D=A')
+                self._write(f'@{segment_symbol}')
+                self._write('D=D+M')
+                self._write('@R14')
+                self._write('M=D')
+                self._write('@R13')
+                self._write('D=M')
+                self._write('@R14')
+                self._write('A=M')
+        else:
+            self._op_a_get_memory_segment_address(memory_segment, address)
+        self._write('M=D')
+
+    def _translate_cached_arithmetic_op(self, operation):
+        if self.shared_runtime and operation in ('eq', 'gt', 'lt'):
+            # shared routine takes both values from the stack.
+            self.spill_top_of_stack()
+            self._translate_arithmetic_op(operation)
+            return
+
+        self._op_d_get_top_of_stack()
+        if operation == 'not':
+            self._write('D=!D')
+        elif operation == 'neg':
+            self._write('D=-D')
+        else:  # two value operation: D = y, M = x
+            self._op_m_decrement_stack_pointer()
+            self._op_m_get_current_stack_value()
+            if operation == 'add':
+                self._write('D=D+M')
+            elif operation == 'sub':
+                self._write('D=M-D')
+            elif operation == 'and':
+                self._write('D=D&M')
+            elif operation == 'or':
+                self._write('D=D|M')
+            elif operation in ('eq', 'gt', 'lt'):
+                self._op_d_write_comp_branch(operation.upper())
+            else:
+                raise NotImplementedError(f"operation {operation} is not implemented.")
+        self.d_is_top_of_stack = True
+
+    def _translate_cached_memory_op(self, operation, memory_segment, address):
+        if operation == 'push':
+            self.spill_top_of_stack()
+            if memory_segment == 'constant':
+                self._write(f'@{address}')
+                self._write('D=A')
+            else:
+                self._op_a_get_memory_segment_address(memory_segment, address)
+                self._write('D=M')
+            self.d_is_top_of_stack = True
+        else:
+            assert operation == 'pop'
+            assert memory_segment != 'constant'
+            self._op_d_get_top_of_stack()
+            self._op_write_d_to_memory_segment(memory_segment, address)
+
+    def _translate_cached_line(self, parser):
+        if parser.operation_type == 'compute':
+            self._translate_cached_arithmetic_op(parser.op_code)
+        elif parser.operation_type == 'memory':
+            self._translate_cached_memory_op(parser.op_code, parser.memory_segment, parser.address)
+        elif parser.operation_type == 'branching' and parser.op_code == 'if-goto':
+            self._op_d_get_top_of_stack()
+            self._write(f'@{parser.label}')
+            self._write('D;JNE')
+        elif parser.operation_type is not None:
+            self.spill_top_of_stack()
+            self._translate_uncached_line(parser)
+
+    def _annotate_command(self, annotation):
+        # attach annotation to the first line emitted for the current command.
+        if self.command_start < len(self.asm_chunks):
+            first_line = self.asm_chunks[self.command_start]
+            self.asm_chunks[self.command_start] = first_line[:-1] + annotation + '\n'
+
     def translate_line(self, parser):
+        self.command_start = len(self.asm_chunks)
+        if self.stack_caching:
+            self._translate_cached_line(parser)
+        else:
+            self._translate_uncached_line(parser)
+        if self.add_annotation and parser.operation_type is not None:
+            self._annotate_command(f'  // {parser.line}')
+
+    def _translate_uncached_line(self, parser):
         if parser.operation_type == 'compute':
             self._translate_arithmetic_op(parser.op_code)
         elif parser.operation_type == 'memory':
@@ -416,26 +642,540 @@ class Translator:
             self._translate_function_definition(parser.function_name, parser.n_lcls)
         elif parser.operation_type == 'return':
             self._translate_return()
-        return self.asm_output
+
+    def _write_runtime_call(self):
+        # D = return address, R13 = n_args, R14 = function address
+        self._op_write_d_to_current_stack_pointer()
+        self._op_m_increment_stack_pointer()
+        self._save_pointers()
+
+        # set ARG (SP - 5 - n_args)
+        self._write('@R13')
+        self._write('D=M')
+        self._write('@5')
+        self._write('D=D+A')
+        self._write('@SP')
+        self._write('D=M-D')
+        self._op_write_d_to_symbol_pointer('ARG')
+
+        self._set_lcl_pointer()
+        self._write('@R14')
+        self._write('A=M')
+        self._write('0;JMP')
+
+    def _write_runtime_comparison(self, comp_type):
+        # R15 = return address
+        self._op_d_pop_value()
+        self._op_m_decrement_stack_pointer()
+        self._op_m_get_current_stack_value()
+        self._write('D=M-D')
+        self._write('@$RUNTIME.TRUE')
+        self._write(f'D;J{comp_type}')
+        self._jump_to_label('$RUNTIME.FALSE')
+
+    def _write_runtime_comparison_result(self):
+        self._write('($RUNTIME.TRUE)', indent=False)
+        self._write('D=-1')
+        self._jump_to_label('$RUNTIME.PUSH_COMPARISON')
+        self._write('($RUNTIME.FALSE)', indent=False)
+        self._write('D=0')
+        self._write('($RUNTIME.PUSH_COMPARISON)', indent=False)
+        self._op_write_d_to_current_stack_pointer()
+        self._op_m_increment_stack_pointer()
+        self._write('@R15')
+        self._write('A=M')
+        self._write('0;JMP')
+
+    def write_runtime(self):
+        """
+        Emit shared routines used so far. Call once, after the last command of the program.
+        """
+        if not self.used_runtime:
+            return
+        if self.add_annotation:
+            self._write('//shared runtime routines', indent=False)
+        # program never falls through into the routines.
+        self._write(f'({self.RUNTIME_HALT})', indent=False)
+        self._jump_to_label(self.RUNTIME_HALT)
+
+        has_comparison = False
+        for label in self.used_runtime:
+            self._write(f'({label})', indent=False)
+            self._get_runtime_writer(label)()
+            has_comparison |= label not in (self.RUNTIME_CALL, self.RUNTIME_RETURN)
+        if has_comparison:
+            self._write_runtime_comparison_result()
 
     def set_file_name(self, file_name):
         self.file_name = file_name
+        if self.namespace_labels:
+            self.label_prefix = f'{file_name}$'
+            self.label_counter = 0
+
+    @property
+    def asm_output(self):
+        return ''.join(self.asm_chunks)
+
+    @property
+    def line_count(self):
+        # lines emitted so far, flushed or not.
+        return self.lines_flushed + len(self.asm_chunks)
+
+    def flush(self, wf):
+        wf.write(''.join(self.asm_chunks))
+        self.lines_flushed += len(self.asm_chunks)
+        self.clear_output()
 
     def clear_output(self):
-        self.asm_output = ''
+        self.asm_chunks = []
+        self.command_start = 0
+
+
+class VMOptimizer:
+    """
+    Optimization passes over VM commands in IR form (see Parser.to_command), one function at a time.
+
+    - Constant folding: push constant 3, push constant 4, add -> push constant 7.
+        Also through neg / not, and Math.multiply / Math.divide of two constants.
+        eq / gt / lt fold the way the generated code computes them (sign of 16 bit x - y).
+    - Strength reduction: x + 0, x - 0, x | 0, x & -1, x * 1, x / 1, not not, neg neg are dropped.
+    - Constant-condition branches: constant, if-goto L -> goto L, or nothing.
+        Commands after goto / return are unreachable up to the next label and dropped.
+    - push x, pop x (same segment and index) is dropped.
+    """
+    BINARY_OPS = ('add', 'sub', 'and', 'or', 'eq', 'gt', 'lt')
+    UNARY_OPS = ('neg', 'not')
+
+    @staticmethod
+    def _to_signed(value):
+        value &= 0xFFFF
+        return value - 0x10000 if value & 0x8000 else value
+
+    def _constant_commands(self, value):
+        # push constant only takes 0..32767
+        value = self._to_signed(value)
+        if value >= 0:
+            return [('push', 'constant', value)]
+        if value == -32768:
+            return [('push', 'constant', 32767), ('not', None, None)]
+        return [('push', 'constant', -value), ('neg', None, None)]
+
+    def _trailing_constant(self, commands, end):
+        """
+        (value, start) if commands[start:end] is a sequence pushing a constant, else None.
+        """
+        if end >= 1 and commands[end - 1][:2] == ('push', 'constant'):
+            return self._to_signed(commands[end - 1][2]), end - 1
+        if end >= 2 and commands[end - 1][0] in self.UNARY_OPS and commands[end - 2][:2] == ('push', 'constant'):
+            value = commands[end - 2][2]
+            value = -value if commands[end - 1][0] == 'neg' else ~value
+            return self._to_signed(value), end - 2
+        return None
+
+    def _fold_binary(self, operation, x, y):
+        if operation == 'add':
+            return x + y
+        if operation == 'sub':
+            return x - y
+        if operation == 'and':
+            return x & y
+        if operation == 'or':
+            return x | y
+        diff = self._to_signed(x - y)
+        if operation == 'eq':
+            return -1 if diff == 0 else 0
+        if operation == 'gt':
+            return -1 if diff > 0 else 0
+        return -1 if diff < 0 else 0  # lt
+
+    @staticmethod
+    def _fold_call(function_name, x, y):
+        if function_name == 'Math.multiply':
+            return x * y
+        if y == 0:  # left for the OS to report.
+            return None
+        quotient = abs(x) // abs(y)
+        return quotient if (x < 0) == (y < 0) else -quotient
+
+    def _replace_tail(self, out, start, commands):
+        # only replace when it actually shrinks the code.
+        if len(commands) >= len(out) - start:
+            return False
+        out[start:] = commands
+        return True
+
+    def _fold_tail(self, out):
+        op_code, arg1, arg2 = out[-1]
+        end = len(out) - 1
+
+        if op_code in self.UNARY_OPS:
+            if end >= 1 and out[end - 1][0] == op_code:
+                del out[end - 1:]
+                return True
+            operand = self._trailing_constant(out, end)
+            if operand is not None:
+                value, start = operand
+                value = -value if op_code == 'neg' else ~value
+                return self._replace_tail(out, start, self._constant_commands(value))
+
+        elif op_code in self.BINARY_OPS or (op_code == 'call' and arg1 in ('Math.multiply', 'Math.divide') and arg2 == 2):
+            y = self._trailing_constant(out, end)
+            if y is None:
+                return False
+            y_value, y_start = y
+            x = self._trailing_constant(out, y_start)
+            if x is not None:
+                x_value, x_start = x
+                if op_code == 'call':
+                    value = self._fold_call(arg1, x_value, y_value)
+                    if value is None:
+                        return False
+                else:
+                    value = self._fold_binary(op_code, x_value, y_value)
+                return self._replace_tail(out, x_start, self._constant_commands(value))
+
+            identity = {'add': 0, 'sub': 0, 'or': 0, 'and': -1, 'call': 1}
+            if op_code in identity and y_value == identity[op_code]:
+                del out[y_start:]
+                return True
+
+        elif op_code == 'if-goto':
+            condition = self._trailing_constant(out, end)
+            if condition is not None:
+                value, start = condition
+                out[start:] = [('goto', arg1, None)] if value != 0 else []
+                return True
+
+        elif op_code == 'pop' and end >= 1 and out[end - 1] == ('push', arg1, arg2) and arg1 != 'constant':
+            del out[end - 1:]
+            return True
+        return False
+
+    @staticmethod
+    def _split_functions(commands):
+        functions = [[]]
+        for command in commands:
+            if command[0] == 'function' and functions[-1]:
+                functions.append([])
+            functions[-1].append(command)
+        return functions if functions[0] else []
+
+    def _optimize_function(self, commands):
+        out = []
+        for command in commands:
+            if out and out[-1][0] in ('goto', 'return') and command[0] not in ('label', 'function'):
+                continue  # unreachable
+            out.append(command)
+            while out and self._fold_tail(out):
+                pass
+        return out
+
+    def optimize(self, commands):
+        optimized = []
+        for function_commands in self._split_functions(commands):
+            optimized.extend(self._optimize_function(function_commands))
+        return optimized
+
+
+class VMInliner:
+    """
+    Inline small leaf functions at their call sites (IR passes over the whole program).
+
+    A callee is inlined when:
+        - its body has at most threshold commands and makes no call (so it can't be recursive)
+        - the stack holds exactly the return value at every return
+        - it doesn't use static segment, unless the call site is in the same file
+    The inlined body has no frame: argument / local (and THIS, THAT if the body sets pointer)
+    live in static slots past the caller file's own statics. Inlined bodies contain no calls,
+    so two of them are never active at the same time and one scratch area per file is enough.
+    Labels of the body are renamed per call site.
+    """
+    STACK_EFFECTS = {
+        'push': 1, 'pop': -1, 'if-goto': -1, 'goto': 0, 'label': 0, 'neg': 0, 'not': 0,
+        'add': -1, 'sub': -1, 'and': -1, 'or': -1, 'eq': -1, 'gt': -1, 'lt': -1,
+    }
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.n_inlined = 0
+
+    def _has_clean_returns(self, body):
+        # stack depth of the body, relative to its start, has to be consistent at labels and 1 at return.
+        label_depths = {}
+        depth = 0
+        for op_code, arg1, _ in body:
+            if op_code == 'label':
+                if depth is None:
+                    depth = label_depths.get(arg1)
+                    if depth is None:
+                        return False
+                elif label_depths.setdefault(arg1, depth) != depth:
+                    return False
+                continue
+            if depth is None:
+                continue  # unreachable
+            if op_code == 'return':
+                if depth != 1:
+                    return False
+                depth = None
+                continue
+            if op_code not in self.STACK_EFFECTS:
+                return False
+            depth += self.STACK_EFFECTS[op_code]
+            if depth < 0:
+                return False
+            if op_code in ('goto', 'if-goto'):
+                if label_depths.setdefault(arg1, depth) != depth:
+                    return False
+                if op_code == 'goto':
+                    depth = None
+        return depth is None
+
+    def _find_inlinable(self, program):
+        # function name -> (file_name, n_lcls, body)
+        inlinable = {}
+        for file_name, commands in program:
+            for function_commands in VMOptimizer._split_functions(commands):
+                op_code, fn_name, n_lcls = function_commands[0]
+                body = function_commands[1:]
+                if op_code != 'function' or len(body) > self.threshold:
+                    continue
+                if any(command[0] == 'call' for command in body) or not self._has_clean_returns(body):
+                    continue
+                inlinable[fn_name] = (file_name, n_lcls, body)
+        return inlinable
+
+    @staticmethod
+    def _uses_static(body):
+        return any(command[1] == 'static' for command in body if command[0] in ('push', 'pop'))
+
+    @staticmethod
+    def _next_static_index(commands):
+        indices = [command[2] for command in commands if command[0] in ('push', 'pop') and command[1] == 'static']
+        return max(indices) + 1 if indices else 0
+
+    def _expand(self, fn_name, n_args, n_lcls, body, base):
+        instance = f'{fn_name}$inline.{self.n_inlined}'
+        self.n_inlined += 1
+        local_base = base + n_args
+        pointers = sorted({command[2] for command in body if command[:2] == ('pop', 'pointer')})
+        pointer_slots = {idx: local_base + n_lcls + n for n, idx in enumerate(pointers)}
+
+        expanded = [('pop', 'static', base + idx) for idx in reversed(range(n_args))]
+        for idx in range(n_lcls):
+            expanded += [('push', 'constant', 0), ('pop', 'static', local_base + idx)]
+        for idx, slot in pointer_slots.items():
+            expanded += [('push', 'pointer', idx), ('pop', 'static', slot)]
+
+        for op_code, arg1, arg2 in body:
+            if op_code in ('push', 'pop') and arg1 == 'argument':
+                expanded.append((op_code, 'static', base + arg2))
+            elif op_code in ('push', 'pop') and arg1 == 'local':
+                expanded.append((op_code, 'static', local_base + arg2))
+            elif op_code in ('label', 'goto', 'if-goto'):
+                expanded.append((op_code, f'{instance}.{arg1}', None))
+            elif op_code == 'return':
+                expanded.append(('goto', instance, None))
+            else:
+                expanded.append((op_code, arg1, arg2))
+        if expanded[-1] == ('goto', instance, None):
+            expanded.pop()
+        expanded.append(('label', instance, None))
+
+        # restore THIS / THAT of the caller, return value stays on top.
+        for idx, slot in pointer_slots.items():
+            expanded += [('push', 'static', slot), ('pop', 'pointer', idx)]
+        return expanded
+
+    def inline(self, program):
+        inlinable = self._find_inlinable(program)
+        if not inlinable:
+            return program
+
+        inlined_program = []
+        for file_name, commands in program:
+            base = self._next_static_index(commands)
+            inlined = []
+            for command in commands:
+                op_code, fn_name, n_args = command
+                callee = inlinable.get(fn_name) if op_code == 'call' else None
+                if callee is None or (callee[0] != file_name and self._uses_static(callee[2])):
+                    inlined.append(command)
+                    continue
+                _, n_lcls, body = callee
+                inlined.extend(self._expand(fn_name, n_args, n_lcls, body, base))
+            inlined_program.append((file_name, inlined))
+        return inlined_program
+
+
+class PeepholeOptimizer:
+    """
+    Optimization pass over generated Hack assembly lines (one line per chunk, as buffered by Translator).
+    Labels are barriers: nothing is assumed about register values right after a label.
+
+    - SP round-trip: [@SP, M=M+1, @SP, M=M-1] cancels out, when A is reloaded right after.
+    - Duplicate A loads: @X when A already holds X, [@SP, A=M] when A already holds *SP.
+    - Duplicate D loads: D=0 / D=1 / D=-1 when D already holds that constant.
+    - Redundant reload: D=M right after M=D.
+    - Dead stores: M=x directly overwritten by the next instruction without reading M.
+    - Jump-to-jump chains: jumps to a label whose code is just [@L, 0;JMP] go to L directly.
+    """
+    D_CONSTANTS = ('0', '1', '-1')
+
+    @staticmethod
+    def _split_line(chunk):
+        line = chunk.rstrip('\n')
+        code, sep, comment = line.partition('//')
+        annotation = code[len(code.rstrip()):] + sep + comment if sep else ''
+        code = code.strip()
+        indent = line[:len(line) - len(line.lstrip())]
+        return [code, indent, annotation]
+
+    @staticmethod
+    def _join_line(line):
+        code, indent, annotation = line
+        return indent + code + annotation + '\n'
+
+    @staticmethod
+    def _parse_c_instruction(code):
+        dest, _, others = code.rpartition('=')
+        comp, _, jmp = others.partition(';')
+        return dest, comp, jmp
+
+    @staticmethod
+    def _drop(lines, idx, kept):
+        # annotations of dropped lines move on to the next kept line.
+        annotation = lines[idx][2]
+        if annotation and idx + 1 < len(lines):
+            lines[idx + 1][2] = annotation + lines[idx + 1][2]
+        elif annotation and kept:
+            kept[-1][2] += annotation
+
+    def optimize(self, chunks):
+        lines = [self._split_line(chunk) for chunk in chunks]
+        changed = True
+        while changed:
+            lines, round_trip_changed = self._remove_sp_round_trips(lines)
+            lines, redundant_changed = self._remove_redundant_instructions(lines)
+            jump_changed = self._thread_jumps(lines)
+            changed = round_trip_changed or redundant_changed or jump_changed
+        return [self._join_line(line) for line in lines]
+
+    def _remove_sp_round_trips(self, lines):
+        kept = []
+        idx = 0
+        changed = False
+        while idx < len(lines):
+            codes = [line[0] for line in lines[idx:idx + 5]]
+            if codes[:4] == ['@SP', 'M=M+1', '@SP', 'M=M-1'] and len(codes) == 5 and codes[4].startswith('@'):
+                for offset in range(4):
+                    self._drop(lines, idx + offset, kept)
+                idx += 4
+                changed = True
+                continue
+            kept.append(lines[idx])
+            idx += 1
+        return kept, changed
+
+    def _remove_redundant_instructions(self, lines):
+        kept = []
+        changed = False
+        a_state = None  # ('symbol', X): A == X, ('deref', 'SP'): A == RAM[SP]
+        d_state = None  # one of D_CONSTANTS when known
+        idx = 0
+        while idx < len(lines):
+            code = lines[idx][0]
+            if code.startswith('('):
+                a_state = d_state = None
+            elif code.startswith('@'):
+                next_code = lines[idx + 1][0] if idx + 1 < len(lines) else None
+                if a_state == ('symbol', code[1:]):
+                    self._drop(lines, idx, kept)
+                    changed = True
+                    idx += 1
+                    continue
+                if code == '@SP' and next_code == 'A=M' and a_state == ('deref', 'SP'):
+                    self._drop(lines, idx, kept)
+                    self._drop(lines, idx + 1, kept)
+                    changed = True
+                    idx += 2
+                    continue
+                a_state = ('symbol', code[1:])
+            else:
+                dest, comp, jmp = self._parse_c_instruction(code)
+                prev_code = kept[-1][0] if kept else ''
+                if dest == 'D' and not jmp and comp in self.D_CONSTANTS and d_state == comp:
+                    self._drop(lines, idx, kept)
+                    changed = True
+                    idx += 1
+                    continue
+                if code == 'D=M' and prev_code == 'M=D':
+                    self._drop(lines, idx, kept)
+                    changed = True
+                    idx += 1
+                    continue
+                if prev_code.startswith('M=') and 'M' in dest and 'M' not in comp and 'A' not in dest:
+                    # previous store to the same address is overwritten before anyone reads it.
+                    kept.pop()
+                    changed = True
+
+                if 'D' in dest:
+                    d_state = comp if comp in self.D_CONSTANTS else None
+                if 'A' in dest:
+                    # SP itself (address 0) is never a stack address, so *SP survives M writes.
+                    a_state = ('deref', 'SP') if code == 'A=M' and a_state == ('symbol', 'SP') else None
+            kept.append(lines[idx])
+            idx += 1
+        return kept, changed
+
+    def _thread_jumps(self, lines):
+        # label -> label it immediately jumps to
+        first_code_after = {}
+        pending_labels = []
+        for idx, (code, _, _) in enumerate(lines):
+            if code.startswith('('):
+                pending_labels.append(code[1:-1])
+                continue
+            for label in pending_labels:
+                next_code = lines[idx + 1][0] if idx + 1 < len(lines) else None
+                if code.startswith('@') and next_code == '0;JMP':
+                    first_code_after[label] = code[1:]
+            pending_labels = []
+
+        changed = False
+        for idx in range(len(lines) - 1):
+            code = lines[idx][0]
+            if not code.startswith('@') or code[1:] not in first_code_after:
+                continue
+            dest, _, jmp = self._parse_c_instruction(lines[idx + 1][0])
+            if not jmp or 'A' in dest or lines[idx + 1][0].startswith(('@', '(')):
+                continue
+            target = code[1:]
+            seen = {target}
+            while target in first_code_after and first_code_after[target] not in seen:
+                target = first_code_after[target]
+                seen.add(target)
+            if target != code[1:]:
+                lines[idx][0] = f'@{target}'
+                changed = True
+        return changed
 
 
 class VMtranslator:
+    # buffered lines are written out once this many are pending.
+    FLUSH_CHUNKS = 1 << 14
+
     def __init__(self, dir_or_path, include_bootstrapping=True):
         self.file_paths = self._get_file_paths(dir_or_path)
         self.save_path = self._get_save_path(dir_or_path)
         self.include_bootstrapping = include_bootstrapping
+        self.dropped_functions = None
 
     @staticmethod
     def _get_file_paths(dir_or_path):
         if os.path.isdir(dir_or_path):
             current_dir = os.path.join(dir_or_path, '*.vm')
-            paths = glob(current_dir)
+            paths = sorted(glob(current_dir))
         else:
             paths = [dir_or_path]
         return paths
@@ -447,37 +1187,298 @@ class VMtranslator:
             file_name += '.asm'
             save_path = os.path.join(dir_or_path, file_name)
         else:
-            save_path = dir_or_path.replace('vm', 'asm')
+            save_path = os.path.splitext(dir_or_path)[0] + '.asm'
         return save_path
 
     @staticmethod
     def _get_file_name(file_path):
         return file_path.split('/')[-1].split('.')[0]
 
-    def translate(self, add_annotation=False):
+    def translate(self, add_annotation=False, cache=None, print_output=True, optimize=False, shared_runtime=False,
+                  stack_caching=False, optimize_vm=False, eliminate_dead_functions=False, workers=1,
+                  inline_threshold=None, output=None, source_map_path=None):
+        """
+        If output (file object) is given, assembly is written there instead of the .asm save path,
+            and cache / print_output don't apply.
+        If source_map_path is given, a json source map of VM commands is written there:
+            {'commands': [{'file', 'line', 'function', 'command', 'asm_lines': [first, last]}, ...]}
+            Line numbers start at 1, asm_lines is inclusive. VM line numbers are None when the program
+            goes through IR passes (optimize_vm, eliminate_dead_functions, inline_threshold).
+            Not available with optimize or workers > 1, as those rewrite / reorder the emitted lines.
+        If cache (BuildCache) is given, unchanged inputs are copied from the cache instead of translated.
+        If print_output, the whole output is echoed on console afterwards.
+        If optimize, generated assembly goes through PeepholeOptimizer before it is written.
+        If shared_runtime, call / return / comparisons jump into shared routines (see Translator).
+        If stack_caching, top of the stack is kept in D across commands (see Translator).
+        If optimize_vm, each file is read into IR and goes through VMOptimizer before code generation.
+        If eliminate_dead_functions, only functions reachable from Sys.init
+            (or the first function, without bootstrapping) are emitted. Dropped ones are reported.
+        If inline_threshold is set, leaf functions of at most that many commands are inlined (see VMInliner).
+        If workers > 1, files are translated in a process pool with per-file namespaced labels
+            (see Translator), and concatenated in file order. Output doesn't depend on scheduling.
+        """
+        options = {
+            'add_annotation': add_annotation,
+            'include_bootstrapping': self.include_bootstrapping,
+            'optimize': optimize,
+            'shared_runtime': shared_runtime,
+            'stack_caching': stack_caching,
+            'optimize_vm': optimize_vm,
+            'eliminate_dead_functions': eliminate_dead_functions,
+            'inline_threshold': inline_threshold,
+            'namespace_labels': workers > 1,
+        }
+        self.dropped_functions = None
+        source_map = None
+        if source_map_path is not None:
+            if optimize or workers > 1:
+                raise ValueError('source maps are not available with optimize or workers > 1')
+            source_map = {'commands': []}
+        if output is not None:
+            self._translate(output, workers=workers, source_map=source_map, **options)
+            self._write_source_map(source_map, source_map_path)
+        elif cache is not None:
+            output_paths = [self.save_path]
+            key_options = options
+            if source_map_path is not None:
+                output_paths.append(source_map_path)
+                key_options = dict(options, source_map=True)
+            key = cache.make_key(__file__, self.file_paths, key_options)
+            if not cache.get(key, output_paths):
+                self._translate_to_save_path(workers=workers, source_map=source_map, **options)
+                self._write_source_map(source_map, source_map_path)
+                cache.put(key, output_paths)
+        else:
+            self._translate_to_save_path(workers=workers, source_map=source_map, **options)
+            self._write_source_map(source_map, source_map_path)
+
+        if print_output and output is None:
+            with open(self.save_path, 'r') as f:
+                print(f.read())
+        if self.dropped_functions:
+            print(f'dropped {len(self.dropped_functions)} unreachable functions: {", ".join(self.dropped_functions)}')
+
+    @staticmethod
+    def _write_source_map(source_map, path):
+        if source_map is not None:
+            with open(path, 'w') as wf:
+                json.dump(source_map, wf)
+
+    @staticmethod
+    def _read_commands(path, parser):
+        commands = []
+        with open(path, 'r') as rf:
+            for line in rf:
+                parser.parse_line(line)
+                command = parser.to_command()
+                if command is not None:
+                    commands.append(command)
+        return commands
+
+    @staticmethod
+    def _iter_lines(path, parser):
+        # yields the same parser, set to each line in turn.
+        with open(path, 'r') as rf:
+            for line in rf:
+                parser.parse_line(line)
+                yield parser
+
+    @staticmethod
+    def _iter_commands(commands, parser):
+        for command in commands:
+            parser.load_command(command)
+            yield parser
+
+    @staticmethod
+    def _find_reachable_functions(program, include_bootstrapping):
+        """
+        Call graph from call / function commands. Returns None if there is no root to start from.
+        Calls outside of any function (plain command files) are roots as well.
+        """
+        callees = {}
+        roots = []
+        for _, commands in program:
+            current = None
+            for op_code, arg1, _ in commands:
+                if op_code == 'function':
+                    current = arg1
+                    callees.setdefault(current, [])
+                elif op_code == 'call':
+                    if current is None:
+                        roots.append(arg1)
+                    else:
+                        callees[current].append(arg1)
+
+        if include_bootstrapping:
+            roots.append('Sys.init')
+        elif callees:
+            roots.append(next(iter(callees)))
+        if not any(root in callees for root in roots):
+            return None
+
+        reachable = set()
+        stack = roots
+        while stack:
+            fn_name = stack.pop()
+            if fn_name in reachable:
+                continue
+            reachable.add(fn_name)
+            stack.extend(callees.get(fn_name, ()))
+        return reachable
+
+    def _eliminate_dead_functions(self, program, include_bootstrapping):
+        reachable = self._find_reachable_functions(program, include_bootstrapping)
+        if reachable is None:
+            self.dropped_functions = []
+            return program
+
+        dropped = []
+        linked_program = []
+        for file_name, commands in program:
+            kept = []
+            keep = True
+            for command in commands:
+                if command[0] == 'function':
+                    keep = command[1] in reachable
+                    if not keep:
+                        dropped.append(command[1])
+                if keep:
+                    kept.append(command)
+            linked_program.append((file_name, kept))
+        self.dropped_functions = dropped
+        return linked_program
+
+    @staticmethod
+    def _optimize_program(program):
+        return [(file_name, VMOptimizer().optimize(commands)) for file_name, commands in program]
+
+    def _read_program(self, parser, include_bootstrapping, optimize_vm, eliminate_dead_functions, inline_threshold):
+        # [(file_name, commands)] for passes that need the IR of the whole program.
+        program = [(self._get_file_name(path), self._read_commands(path, parser)) for path in self.file_paths]
+        if optimize_vm:
+            program = self._optimize_program(program)
+        if inline_threshold is not None:
+            program = VMInliner(inline_threshold).inline(program)
+            if optimize_vm:
+                program = self._optimize_program(program)
+        if eliminate_dead_functions:
+            program = self._eliminate_dead_functions(program, include_bootstrapping)
+        return program
+
+    def _iter_files(self, parser, include_bootstrapping, optimize_vm, eliminate_dead_functions, inline_threshold):
+        """
+        yields (file_name, parser states), line by line unless the whole program is needed as IR first.
+        """
+        if not (optimize_vm or eliminate_dead_functions or inline_threshold is not None):
+            for path in self.file_paths:
+                yield self._get_file_name(path), self._iter_lines(path, parser)
+            return
+
+        program = self._read_program(
+            parser, include_bootstrapping, optimize_vm, eliminate_dead_functions, inline_threshold
+        )
+        for file_name, commands in program:
+            yield file_name, self._iter_commands(commands, parser)
+
+    @staticmethod
+    def _translate_file_chunk(job):
+        """
+        Translate one file on its own. Runs in worker processes.
+        Returns the file's assembly and the shared runtime routines it uses.
+        """
+        file_name, path, commands, optimize_vm, translator_options = job
         parser = Parser()
-        translator = Translator(add_annotation, self.include_bootstrapping)
-        for idx, path in enumerate(self.file_paths):
-            file_name = self._get_file_name(path)
-            translator.file_name = file_name
-            with open(path, 'r') as rf:
-                write_mode = 'w' if idx == 0 else 'a'
-                with open(self.save_path, write_mode) as wf:
-                    for line in rf:
-                        parser.parse_line(line)
-                        asm_line = translator.translate_line(parser)
-                        if len(asm_line) != 0:
-                            if add_annotation and parser.op_code:
-                                annotation = f'  // {parser.line}'
-                                line_split = asm_line.split('\n')
-                                line_split[0] += annotation
-                                asm_line = '\n'.join(line_split)
-                            wf.write(asm_line)
-                        translator.clear_output()
-
-        # print output on console
-        with open(self.save_path, 'r') as f:
-            print(f.read())
+        translator = Translator(initialize=False, **translator_options)
+        translator.set_file_name(file_name)
+        if commands is None:
+            if optimize_vm:
+                parsed_lines = VMtranslator._iter_commands(
+                    VMOptimizer().optimize(VMtranslator._read_commands(path, parser)), parser
+                )
+            else:
+                parsed_lines = VMtranslator._iter_lines(path, parser)
+        else:
+            parsed_lines = VMtranslator._iter_commands(commands, parser)
+        for parsed in parsed_lines:
+            translator.translate_line(parsed)
+        translator.spill_top_of_stack()
+        return translator.asm_output, translator.used_runtime
+
+    def _translate_file_chunks(self, parser, translator_options, include_bootstrapping, optimize_vm,
+                               eliminate_dead_functions, inline_threshold, workers):
+        if eliminate_dead_functions or inline_threshold is not None:
+            # reachability / inlining need the whole program, so IR is built here and shipped to workers.
+            program = self._read_program(
+                parser, include_bootstrapping, optimize_vm, eliminate_dead_functions, inline_threshold
+            )
+            jobs = [(file_name, None, commands, False, translator_options) for file_name, commands in program]
+        else:
+            jobs = [
+                (self._get_file_name(path), path, None, optimize_vm, translator_options) for path in self.file_paths
+            ]
+        if workers <= 1 or len(jobs) <= 1:
+            return [self._translate_file_chunk(job) for job in jobs]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(self._translate_file_chunk, jobs))
+
+    def _translate_to_save_path(self, **options):
+        with open(self.save_path, 'w') as wf:
+            self._translate(wf, **options)
+
+    def _translate(self, wf, add_annotation, include_bootstrapping, optimize=False, shared_runtime=False,
+                   stack_caching=False, optimize_vm=False, eliminate_dead_functions=False, inline_threshold=None,
+                   namespace_labels=False, workers=1, source_map=None):
+        parser = Parser()
+        translator_options = {
+            'add_annotation': add_annotation,
+            'include_bootstrapping': include_bootstrapping,
+            'shared_runtime': shared_runtime,
+            'stack_caching': stack_caching,
+            'namespace_labels': namespace_labels,
+        }
+        translator = Translator(**translator_options)
+        if namespace_labels:
+            chunks = self._translate_file_chunks(
+                parser, translator_options, include_bootstrapping, optimize_vm, eliminate_dead_functions,
+                inline_threshold, workers
+            )
+            for asm_output, used_runtime in chunks:
+                translator.use_runtime(used_runtime)
+                if optimize:
+                    translator.asm_chunks.extend(asm_output.splitlines(keepends=True))
+                else:
+                    translator.flush(wf)
+                    wf.write(asm_output)
+        else:
+            files = self._iter_files(
+                parser, include_bootstrapping, optimize_vm, eliminate_dead_functions, inline_threshold
+            )
+            # the line by line path yields once per source line, IR passes lose line numbers.
+            has_line_numbers = not (optimize_vm or eliminate_dead_functions or inline_threshold is not None)
+            function_name = None
+            for file_name, parsed_lines in files:
+                translator.set_file_name(file_name)
+                for line_number, parsed in enumerate(parsed_lines, 1):
+                    first_line = translator.line_count + 1
+                    translator.translate_line(parsed)
+                    if source_map is not None and parsed.operation_type is not None:
+                        if parsed.operation_type == 'function':
+                            function_name = parsed.function_name
+                        source_map['commands'].append({
+                            'file': file_name,
+                            'line': line_number if has_line_numbers else None,
+                            'function': function_name,
+                            'command': parsed.line,
+                            'asm_lines': [first_line, translator.line_count],
+                        })
+                    # jump threading needs the whole program, so optimized output is flushed once.
+                    if not optimize and len(translator.asm_chunks) >= self.FLUSH_CHUNKS:
+                        translator.flush(wf)
+                translator.spill_top_of_stack()
+        translator.write_runtime()
+        if optimize:
+            translator.asm_chunks = PeepholeOptimizer().optimize(translator.asm_chunks)
+        translator.flush(wf)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,25 @@
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'tools'))
+from hack_emulator import BlockEmulator  # noqa: E402
+
+JMP = 0b1110101010000111  # 0;JMP
+
+
+def test_halt_detection_follows_rewritten_preceding_word():
+    # 0;JMP at address 1 is a halt loop only while ROM[0] is @0
+    emulator = BlockEmulator([5, JMP])
+    emulator.pc, emulator.a = 1, 0
+    emulator.run(10)
+    assert not emulator.halted
+
+    emulator.write_rom(0, 0)
+    emulator.pc, emulator.a = 1, 0
+    assert emulator.run(1000) < 10
+    assert emulator.halted and emulator.pc == 1
+
+    emulator.write_rom(0, 5)
+    emulator.pc, emulator.a, emulator.halted = 1, 0, False
+    emulator.run(10)
+    assert not emulator.halted
@@ -0,0 +1,20 @@
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'tools'))
+from tst_runner import CPUTarget  # noqa: E402
+
+HALTING_PROGRAM = '@2\nD=A\n@0\nM=D\n(END)\n@END\n0;JMP\n'
+
+
+def test_ticktock_through_halt_loop(tmp_path):
+    asm_path = tmp_path / 'Halt.asm'
+    asm_path.write_text(HALTING_PROGRAM)
+    target = CPUTarget(str(asm_path))
+    pcs = []
+    for _ in range(10):
+        target.ticktock()
+        pcs.append(target.get('PC')[0])
+    assert pcs == [1, 2, 3, 4, 5, 4, 5, 4, 5, 4]
+    assert target.get('RAM[0]')[0] == 2
+    assert target.get('time')[0] == '10'
@@ -0,0 +1,21 @@
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'tools'))
+from vm_interpreter import VMInterpreter  # noqa: E402
+
+
+def test_call_past_32k_commands(tmp_path):
+    # a call whose return command index doesn't fit a signed 16 bit word
+    lines = ['function Sys.init 0']
+    lines += ['push constant 0', 'pop temp 1'] * 17_000
+    lines += ['push constant 7', 'call Sys.double 1', 'pop temp 0', 'label END', 'goto END']
+    lines += ['function Sys.double 0', 'push argument 0', 'push argument 0', 'add', 'return']
+    (tmp_path / 'Sys.vm').write_text('\n'.join(lines) + '\n')
+
+    interpreter = VMInterpreter(str(tmp_path))
+    assert len(interpreter.program) > 32768
+    interpreter.run(100_000)
+    assert interpreter.halted
+    assert interpreter.ram[5] == 14
+    assert interpreter.ram[0] == 261
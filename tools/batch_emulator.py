@@ -0,0 +1,141 @@
+import os
+import sys
+
+try:
+    import numpy as np
+except ImportError:  # optional, only BatchEmulator needs it
+    np = None
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from hack_emulator import HackEmulator  # noqa: E402
+
+
+class BatchEmulator:
+    """
+    Runs one Hack program over N machine states in lockstep, e.g. a whole matrix of test inputs.
+
+    A, D, PC and cycle counters are length-N vectors, RAM is an N x 32K int16 matrix.
+    Each step picks the lowest PC among the running lanes and executes that instruction
+    for every lane sitting on it, with one set of vectorized operations. Lanes that took
+    a different branch wait at their own PC (masked out) until the others catch up, which is
+    where loops with different trip counts reconverge.
+    Lanes stop individually on the halt loop, on running off the ROM or on the cycle budget.
+    """
+    RAM_SIZE = HackEmulator.RAM_SIZE
+
+    def __init__(self, rom, n):
+        if np is None:
+            raise ImportError('BatchEmulator needs numpy (pip install numpy)')
+        self.rom = list(rom)
+        self.ops = [self.decode(address, word) for address, word in enumerate(self.rom)]
+        self.n = n
+        self.ram = np.zeros((n, self.RAM_SIZE), dtype=np.int16)
+        self.a = np.zeros(n, dtype=np.int32)
+        self.d = np.zeros(n, dtype=np.int32)
+        self.pc = np.zeros(n, dtype=np.int32)
+        self.cycles = np.zeros(n, dtype=np.int64)
+        self.halted = np.zeros(n, dtype=bool)
+
+    def decode(self, address, word):
+        """
+        A-instruction: (None, value)
+        C-instruction: (alu bits, reads M, dest, jump, halts)
+        """
+        if not word & 0x8000:
+            return None, word
+        bits = tuple(bool((word >> shift) & 1) for shift in range(11, 5, -1))
+        dest = (word >> 3) & 0b111
+        jump = word & 0b111
+        halts = (jump == 0b111 and not dest and address > 0
+                 and self.rom[address - 1] == address - 1)
+        return bits, bool(word & 0x1000), dest, jump, halts
+
+    @classmethod
+    def from_file(cls, path, n):
+        return cls(HackEmulator.load_rom(path), n)
+
+    @staticmethod
+    def _wrap(values):
+        return ((values + 0x8000) & 0xFFFF) - 0x8000
+
+    def _alu(self, x, y, zx, nx, zy, ny, f, no):
+        if zx:
+            x = np.zeros_like(x)
+        if nx:
+            x = ~x
+        if zy:
+            y = np.zeros_like(y)
+        if ny:
+            y = ~y
+        out = self._wrap(x + y) if f else x & y
+        return ~out if no else out
+
+    def _step(self, pc, lanes, halt_lanes):
+        op = self.ops[pc]
+        if op[0] is None:
+            self.a[lanes] = op[1]
+            self.pc[lanes] = pc + 1
+            return
+
+        bits, reads_m, dest, jump, halts = op
+        a = self.a[lanes]
+        address = a & 0x7FFF
+        y = self.ram[lanes, address].astype(np.int32) if reads_m else a
+        out = self._alu(self.d[lanes], y, *bits)
+        if dest & HackEmulator.DEST_M:
+            self.ram[lanes, address] = out
+        if dest & HackEmulator.DEST_D:
+            self.d[lanes] = out
+        if dest & HackEmulator.DEST_A:
+            self.a[lanes] = out
+
+        if not jump:
+            self.pc[lanes] = pc + 1
+            return
+        if jump == 0b111:
+            taken = np.ones(len(lanes), dtype=bool)
+        else:
+            taken = np.zeros(len(lanes), dtype=bool)
+            if jump & 0b100:
+                taken |= out < 0
+            if jump & 0b010:
+                taken |= out == 0
+            if jump & 0b001:
+                taken |= out > 0
+        next_pc = np.where(taken, address, pc + 1)
+        if halts and halt_lanes:
+            # (END) @END 0;JMP, same check as HackEmulator.run: halted lanes stay on the jump
+            stopped = address == pc - 1
+            self.halted[lanes[stopped]] = True
+            next_pc[stopped] = pc
+        self.pc[lanes] = next_pc
+
+    def run(self, max_cycles, stop_on_halt=True):
+        """
+        Run every lane for at most max_cycles instructions.
+        Returns the vector of cycles each lane executed.
+        """
+        n_ops = len(self.ops)
+        cycles = np.zeros(self.n, dtype=np.int64)
+        # pc of every lane still running, n_ops for the stopped ones
+        queue = np.where(self.halted, n_ops, np.minimum(self.pc, n_ops))
+        if max_cycles <= 0:
+            queue[:] = n_ops
+        steps = 0
+        while True:
+            pc = int(queue.min())
+            if pc >= n_ops:
+                break
+            lanes = np.flatnonzero(queue == pc)
+            self._step(pc, lanes, stop_on_halt)
+            cycles[lanes] += 1
+            queue[lanes] = np.minimum(self.pc[lanes], n_ops)
+            if self.ops[pc][0] is not None and self.ops[pc][4]:
+                queue[lanes[self.halted[lanes]]] = n_ops
+            steps += 1
+            if steps >= max_cycles:
+                # no lane can have run more cycles than there were steps
+                queue[cycles >= max_cycles] = n_ops
+
+        self.cycles += cycles
+        return cycles
@@ -0,0 +1,251 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.append(os.path.join(ROOT_DIR, '06_Assembler'))
+sys.path.append(os.path.join(ROOT_DIR, '07_VM_Translator'))
+from assembler import Assembler, Parser as AsmParser, SymbolManager  # noqa: E402
+from vm_translator import Parser as VMParser, VMtranslator  # noqa: E402
+
+COMPS = ['D', 'A', 'M', 'D+1', 'D-1', 'D+A', 'D-M', 'M+1', 'D&M', 'D|A', '!D', '-1', '0']
+DESTS = ['D', 'M', 'A', 'MD', 'AM', 'AD']
+JUMPS = ['JGT', 'JEQ', 'JLT', 'JNE', 'JMP']
+
+
+def generate_asm(path, n_instructions, n_labels, n_variables, seed=0):
+    """
+    Writes a synthetic .asm program: n_instructions A / C instructions (at most the 32K of the ROM)
+    with n_labels labels spread over it, jumps to labels before and after them, n_variables variables,
+    plus comments and blank lines. Returns the number of lines written.
+    """
+    if n_instructions > 32768:
+        raise ValueError('a Hack program holds at most 32768 instructions')
+    rng = random.Random(seed)
+    labels = [f'LABEL_{idx}' for idx in range(n_labels)]
+    variables = [f'var_{idx}' for idx in range(n_variables)]
+    label_every = max(1, n_instructions // max(1, n_labels))
+    lines = ['// synthetic benchmark program']
+    address = 0
+    next_label = 0
+    while address < n_instructions:
+        if address >= next_label * label_every and next_label < n_labels:
+            lines.append(f'({labels[next_label]})')
+            next_label += 1
+        kind = rng.random()
+        if kind < 0.15 and labels and address + 2 <= n_instructions:
+            lines += [f'    @{rng.choice(labels)}', f'    D;{rng.choice(JUMPS)}']
+            address += 2
+            continue
+        if kind < 0.45 and variables:
+            lines.append(f'    @{rng.choice(variables)}  // variable')
+        elif kind < 0.6:
+            lines.append(f'    @{rng.randrange(32768)}')
+        else:
+            lines.append(f'    {rng.choice(DESTS)}={rng.choice(COMPS)}')
+        address += 1
+        if kind > 0.9:
+            lines += ['', '// comment line']
+    with open(path, 'w') as wf:
+        wf.write('\n'.join(lines) + '\n')
+    return len(lines)
+
+
+def generate_vm(dir_path, n_files, n_functions, seed=0):
+    """
+    Writes a synthetic VM program: Sys.vm plus n_files files of n_functions functions each.
+    Every function calls the next one (across files), so calls nest n_files * n_functions deep,
+    and does some arithmetic, memory segment traffic, comparisons and a loop.
+    Returns the number of lines written.
+    """
+    rng = random.Random(seed)
+    names = [f'File{file_idx}.fn{fn_idx}' for file_idx in range(n_files) for fn_idx in range(n_functions)]
+    n_lines = 0
+    with open(os.path.join(dir_path, 'Sys.vm'), 'w') as wf:
+        lines = ['function Sys.init 0', 'push constant 3', f'call {names[0]} 1', 'pop temp 0']
+        lines += ['label END', 'goto END']
+        wf.write('\n'.join(lines) + '\n')
+        n_lines += len(lines)
+    for file_idx in range(n_files):
+        lines = []
+        for fn_idx in range(n_functions):
+            idx = file_idx * n_functions + fn_idx
+            lines += [f'// {names[idx]}', f'function {names[idx]} 2', 'push argument 0', 'pop local 0']
+            lines += [f'label LOOP_{idx}', 'push local 0', f'push constant {rng.randrange(100)}', 'gt']
+            lines += [f'if-goto END_{idx}', 'push local 0', 'push constant 1', 'add', 'pop local 0']
+            lines += [f'push static {fn_idx % 8}', 'push local 1', 'sub', 'neg', f'pop static {fn_idx % 8}']
+            lines += [f'goto LOOP_{idx}', f'label END_{idx}', 'push local 0']
+            if idx + 1 < len(names):
+                lines += [f'call {names[idx + 1]} 1', 'push argument 0', 'and']
+            lines += ['return']
+        with open(os.path.join(dir_path, f'File{file_idx}.vm'), 'w') as wf:
+            wf.write('\n'.join(lines) + '\n')
+        n_lines += len(lines)
+    return n_lines
+
+
+def _parse_asm(path):
+    parser = AsmParser()
+    with open(path, 'r') as rf:
+        for line in rf:
+            parser.parse_line(line)
+
+
+def _tokenize_asm(path):
+    with open(path, 'r') as rf:
+        Assembler._tokenize(rf, SymbolManager())
+
+
+def _assemble_streaming(path, output_path):
+    with open(path, 'r') as rf:
+        Assembler().translate_lines(rf, output_path)
+
+
+def _parse_vm(dir_path):
+    parser = VMParser()
+    for path in VMtranslator(dir_path).file_paths:
+        VMtranslator._read_commands(path, parser)
+
+
+def asm_phases(path, output_path):
+    # phase name -> fn(), for an .asm program.
+    return {
+        'parse': lambda: _parse_asm(path),
+        'tokenize': lambda: _tokenize_asm(path),
+        'single_pass': lambda: Assembler().translate(path, output_path, single_pass=True),
+        'two_pass': lambda: Assembler().translate(path, output_path),
+        'streaming': lambda: _assemble_streaming(path, output_path),
+    }
+
+
+def vm_phases(dir_path):
+    """
+    phase name -> fn(), for a directory of .vm files.
+    Output usually outgrows the 32K ROM, so the assembler is left to the asm suite.
+    """
+    return {
+        'parse': lambda: _parse_vm(dir_path),
+        'translate': lambda: VMtranslator(dir_path).translate(print_output=False),
+        'translate_ir': lambda: VMtranslator(dir_path).translate(print_output=False, optimize_vm=True),
+        'translate_peephole': lambda: VMtranslator(dir_path).translate(print_output=False, optimize=True),
+    }
+
+
+def measure(fn, n_lines, repeat=3):
+    """
+    Best of repeat runs for time, then one more run under tracemalloc for peak python memory
+    (timed separately, tracing slows it down).
+    """
+    seconds = float('inf')
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        fn()
+        seconds = min(seconds, time.perf_counter() - start_time)
+    tracemalloc.start()
+    try:
+        fn()
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {'seconds': seconds, 'lines_per_sec': n_lines / seconds, 'peak_bytes': peak_bytes}
+
+
+def run_benchmarks(asm_instructions=32_000, vm_files=20, vm_functions=50, repeat=3, only=None):
+    """
+    Returns {'environment': {...}, 'sizes': {...}, 'results': {name: {seconds, lines_per_sec, peak_bytes}}},
+    names are <suite>/<phase>, e.g. asm/two_pass.
+    only: run just the benchmarks whose name starts with one of these prefixes.
+    """
+    results = {}
+    sizes = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        asm_path = os.path.join(tmp_dir, 'Program.asm')
+        n_asm_lines = generate_asm(asm_path, asm_instructions, asm_instructions // 20, asm_instructions // 50)
+        vm_dir = os.path.join(tmp_dir, 'Program')
+        os.makedirs(vm_dir)
+        n_vm_lines = generate_vm(vm_dir, vm_files, vm_functions)
+        sizes = {'asm_lines': n_asm_lines, 'vm_lines': n_vm_lines, 'vm_files': vm_files + 1}
+
+        output_path = os.path.join(tmp_dir, 'out.hack')
+        suites = [('asm', asm_phases(asm_path, output_path), n_asm_lines)]
+        suites.append(('vm', vm_phases(vm_dir), n_vm_lines))
+        for suite, phases, n_lines in suites:
+            for phase, fn in phases.items():
+                name = f'{suite}/{phase}'
+                if only and not any(name.startswith(prefix) for prefix in only):
+                    continue
+                results[name] = measure(fn, n_lines, repeat)
+    environment = {'python': platform.python_version(), 'implementation': platform.python_implementation()}
+    return {'environment': environment, 'sizes': sizes, 'results': results}
+
+
+def compare(results, baseline, threshold):
+    """
+    Returns [(name, metric, baseline value, value)] for every time or peak memory
+    more than threshold (0.2 = 20%) worse than the baseline. Benchmarks missing on either side are skipped.
+    """
+    if results['sizes'] != baseline['sizes']:
+        raise ValueError(f'baseline was measured on other sizes: {baseline["sizes"]}')
+    regressions = []
+    for name, metrics in results['results'].items():
+        if name not in baseline['results']:
+            continue
+        for metric in ('seconds', 'peak_bytes'):
+            before = baseline['results'][name][metric]
+            if metrics[metric] > before * (1 + threshold):
+                regressions.append((name, metric, before, metrics[metric]))
+    return regressions
+
+
+def format_report(report, baseline=None):
+    lines = [f'{"benchmark":<26}{"seconds":>10}{"lines/sec":>12}{"peak MB":>10}']
+    for name, metrics in report['results'].items():
+        line = f'{name:<26}{metrics["seconds"]:>10.3f}{metrics["lines_per_sec"]:>12.0f}'
+        line += f'{metrics["peak_bytes"] / 1e6:>10.1f}'
+        if baseline is not None and name in baseline['results']:
+            change = metrics['seconds'] / baseline['results'][name]['seconds'] - 1
+            line += f'  {change:+.0%} time'
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description='Benchmark the assembler and VM translator on synthetic programs.')
+    arg_parser.add_argument('--asm-instructions', type=int, default=32_000, help='.asm program size (max 32768)')
+    arg_parser.add_argument('--vm-files', type=int, default=20, help='.vm files besides Sys.vm')
+    arg_parser.add_argument('--vm-functions', type=int, default=50, help='functions per .vm file')
+    arg_parser.add_argument('--repeat', type=int, default=3, help='runs per benchmark, the best one counts')
+    arg_parser.add_argument('--only', action='append', default=None, help='name prefix, e.g. asm/ (repeatable)')
+    arg_parser.add_argument('--save', default=None, help='write results as a json baseline here')
+    arg_parser.add_argument('--baseline', default=None, help='compare against this json baseline')
+    arg_parser.add_argument('--threshold', type=float, default=0.2, help='allowed slowdown / growth, 0.2 = 20%%')
+    args = arg_parser.parse_args(argv)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r') as rf:
+            baseline = json.load(rf)
+    report = run_benchmarks(args.asm_instructions, args.vm_files, args.vm_functions, args.repeat, args.only)
+    print(f'{report["sizes"]["asm_lines"]} asm lines, {report["sizes"]["vm_lines"]} vm lines')
+    print(format_report(report, baseline))
+    if args.save:
+        with open(args.save, 'w') as wf:
+            json.dump(report, wf, indent=2)
+    if baseline is None:
+        return 0
+
+    regressions = compare(report, baseline, args.threshold)
+    for name, metric, before, after in regressions:
+        print(f'REGRESSION {name} {metric}: {before:.6g} -> {after:.6g} ({after / before - 1:+.0%})')
+    print(f'{len(regressions)} regressions over {args.threshold:.0%}')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
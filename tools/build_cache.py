@@ -0,0 +1,95 @@
+import hashlib
+import os
+import shutil
+import tempfile
+
+
+class BuildCache:
+    """
+    On-disk cache of translator outputs.
+
+    Key: hash of the tool source, translator options, and every input file (name + contents).
+    Entry: directory named by the key, holding the output files in order.
+    Eviction: least recently used entries go first once total size exceeds max_bytes.
+        Last use is tracked by the entry directory mtime, which is touched on every hit.
+    """
+    def __init__(self, cache_dir=None, max_bytes=256 * 1024 * 1024):
+        if cache_dir is None:
+            cache_dir = os.path.join(os.path.expanduser('~'), '.cache', 'nand2tetris')
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def _update_with_file(hasher, path):
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 16), b''):
+                hasher.update(chunk)
+
+    def make_key(self, tool_path, input_paths, options):
+        hasher = hashlib.sha256()
+        self._update_with_file(hasher, tool_path)
+        hasher.update(repr(sorted(options.items())).encode())
+        for path in input_paths:
+            hasher.update(b'\0' + os.path.basename(path).encode() + b'\0')
+            self._update_with_file(hasher, path)
+        return hasher.hexdigest()
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def get(self, key, output_paths):
+        """
+        Copy cached outputs to output_paths. Returns False on a miss.
+        """
+        entry_dir = self._entry_dir(key)
+        try:
+            for idx, output_path in enumerate(output_paths):
+                shutil.copyfile(os.path.join(entry_dir, str(idx)), output_path)
+            os.utime(entry_dir)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def put(self, key, output_paths):
+        entry_dir = self._entry_dir(key)
+        if os.path.isdir(entry_dir):
+            return
+        # build the entry aside and rename, so other processes never see a partial entry.
+        tmp_dir = tempfile.mkdtemp(dir=self.cache_dir, prefix='.tmp-')
+        for idx, output_path in enumerate(output_paths):
+            shutil.copyfile(output_path, os.path.join(tmp_dir, str(idx)))
+        try:
+            os.rename(tmp_dir, entry_dir)
+        except OSError:  # same entry was stored concurrently.
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        self._evict()
+
+    @staticmethod
+    def _entry_size(entry_dir):
+        return sum(entry.stat().st_size for entry in os.scandir(entry_dir))
+
+    def _evict(self):
+        entries = []
+        total = 0
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.startswith('.tmp-') or not entry.is_dir():
+                continue
+            try:
+                size = self._entry_size(entry.path)
+                entries.append((entry.stat().st_mtime, size, entry.path))
+            except FileNotFoundError:  # evicted by another process.
+                continue
+            total += size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_dir():
+                shutil.rmtree(entry.path, ignore_errors=True)
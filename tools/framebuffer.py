@@ -0,0 +1,122 @@
+import argparse
+import os
+import sys
+from array import array
+
+try:
+    import numpy as np
+except ImportError:  # optional, only Framebuffer.to_numpy / pixels need it
+    np = None
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from hack_emulator import BlockEmulator, HackEmulator  # noqa: E402
+
+
+class Framebuffer:
+    """
+    The screen memory map of an emulator's RAM, RAM[SCREEN:KBD], without copying it.
+    256 rows of 32 words, bit 0 of a word is its leftmost pixel, 1 is black.
+
+    words: memoryview of the 8K screen words, raw: the same memory as bytes (native byte order).
+    Both follow the RAM as the emulator runs.
+    """
+    SCREEN = HackEmulator.SCREEN
+    KBD = HackEmulator.KBD
+    HEIGHT = 256
+    WIDTH = 512
+    WORDS_PER_ROW = WIDTH // 16
+    PBM_HEADER = f'P4\n{WIDTH} {HEIGHT}\n'.encode()
+    # PBM packs pixels msb first, Hack words are lsb first.
+    REVERSE_BITS = bytes(int(f'{byte:08b}'[::-1], 2) for byte in range(256))
+
+    def __init__(self, ram):
+        self.words = memoryview(ram)[self.SCREEN:self.KBD]
+        self.raw = self.words.cast('B')
+
+    def pixel(self, row, col):
+        return (self.words[row * self.WORDS_PER_ROW + col // 16] >> (col % 16)) & 1
+
+    def to_numpy(self):
+        # (256, 32) uint16 view on the RAM itself.
+        if np is None:
+            raise ImportError('Framebuffer.to_numpy needs numpy (pip install numpy)')
+        return np.frombuffer(self.raw, dtype=np.uint16).reshape(self.HEIGHT, self.WORDS_PER_ROW)
+
+    def pixels(self):
+        # (256, 512) array of 0 / 1, unpacked from the words view.
+        words = self.to_numpy().astype('<u2', copy=False)
+        return np.unpackbits(words.view(np.uint8), axis=1, bitorder='little')
+
+    def snapshot(self):
+        return bytes(self.raw)
+
+    def to_pbm(self):
+        if sys.byteorder == 'little':
+            data = self.raw.tobytes()
+        else:
+            words = array('h', self.words)
+            words.byteswap()
+            data = words.tobytes()
+        return self.PBM_HEADER + data.translate(self.REVERSE_BITS)
+
+    def write_pbm(self, path):
+        with open(path, 'wb') as wf:
+            wf.write(self.to_pbm())
+
+
+class FrameRecorder:
+    """
+    Runs an emulator in slices of `every` cycles. After each slice, on_frame(cycle, framebuffer)
+    is called if the screen changed since the last frame.
+    An unchanged screen costs one comparison against the last frame, the screen is only copied when it changed.
+    """
+    def __init__(self, emulator, every, on_frame):
+        self.emulator = emulator
+        self.every = every
+        self.on_frame = on_frame
+        self.framebuffer = Framebuffer(emulator.ram)
+        self.last_frame = None
+        self.n_frames = 0
+
+    def run(self, max_cycles, stop_on_halt=True):
+        # Returns the number of cycles executed.
+        cycles = 0
+        while cycles < max_cycles:
+            budget = min(self.every, max_cycles - cycles)
+            executed = self.emulator.run(budget, stop_on_halt)
+            cycles += executed
+            if self.framebuffer.raw != self.last_frame:
+                self.last_frame = self.framebuffer.snapshot()
+                self.n_frames += 1
+                self.on_frame(self.emulator.cycles, self.framebuffer)
+            if executed < budget:
+                break
+        return cycles
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description='Run a Hack program and dump screen frames as .pbm files.')
+    arg_parser.add_argument('path', help='.asm, .hack or packed binary ROM')
+    arg_parser.add_argument('-o', '--output-dir', default='.', help='directory for frame_<cycle>.pbm files')
+    arg_parser.add_argument('--cycles', type=int, default=10_000_000, help='cycle budget')
+    arg_parser.add_argument('--every', type=int, default=100_000, help='snapshot the screen every this many cycles')
+    arg_parser.add_argument('--key', type=int, default=0, help='key code held down on the keyboard')
+    arg_parser.add_argument('--blocks', action='store_true', help='compile basic blocks to python functions')
+    args = arg_parser.parse_args(argv)
+
+    emulator_class = BlockEmulator if args.blocks else HackEmulator
+    emulator = emulator_class.from_file(args.path)
+    emulator.set_key(args.key)
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    def write_frame(cycle, framebuffer):
+        framebuffer.write_pbm(os.path.join(args.output_dir, f'frame_{cycle:010d}.pbm'))
+
+    recorder = FrameRecorder(emulator, args.every, write_frame)
+    cycles = recorder.run(args.cycles)
+    print(f'{cycles} cycles, {recorder.n_frames} frames written to {args.output_dir}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,544 @@
+import argparse
+import os
+import sys
+import time
+from array import array
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, '06_Assembler'))
+from assembler import Assembler  # noqa: E402
+
+
+def _wrap(value):
+    # python int -> signed 16 bit
+    return ((value + 0x8000) & 0xFFFF) - 0x8000
+
+
+def _alu(x, y, zx, nx, zy, ny, f, no):
+    if zx:
+        x = 0
+    if nx:
+        x = ~x
+    if zy:
+        y = 0
+    if ny:
+        y = ~y
+    out = _wrap(x + y) if f else x & y
+    return ~out if no else out
+
+
+def _build_comp_functions():
+    """
+    7 bit comp code (a c1..c6) -> fn(a, d, ram) returning the signed ALU output.
+    Documented comps get direct expressions, anything else falls back to the ALU bit semantics.
+    """
+    fast = {
+        0b0101010: lambda a, d, ram: 0,
+        0b0111111: lambda a, d, ram: 1,
+        0b0111010: lambda a, d, ram: -1,
+        0b0001100: lambda a, d, ram: d,
+        0b0110000: lambda a, d, ram: a,
+        0b0001101: lambda a, d, ram: ~d,
+        0b0110001: lambda a, d, ram: ~a,
+        0b0001111: lambda a, d, ram: _wrap(-d),
+        0b0110011: lambda a, d, ram: _wrap(-a),
+        0b0011111: lambda a, d, ram: _wrap(d + 1),
+        0b0110111: lambda a, d, ram: _wrap(a + 1),
+        0b0001110: lambda a, d, ram: _wrap(d - 1),
+        0b0110010: lambda a, d, ram: _wrap(a - 1),
+        0b0000010: lambda a, d, ram: _wrap(d + a),
+        0b0010011: lambda a, d, ram: _wrap(d - a),
+        0b0000111: lambda a, d, ram: _wrap(a - d),
+        0b0000000: lambda a, d, ram: d & a,
+        0b0010101: lambda a, d, ram: d | a,
+        0b1110000: lambda a, d, ram: ram[a],
+        0b1110001: lambda a, d, ram: ~ram[a],
+        0b1110011: lambda a, d, ram: _wrap(-ram[a]),
+        0b1110111: lambda a, d, ram: _wrap(ram[a] + 1),
+        0b1110010: lambda a, d, ram: _wrap(ram[a] - 1),
+        0b1000010: lambda a, d, ram: _wrap(d + ram[a]),
+        0b1010011: lambda a, d, ram: _wrap(d - ram[a]),
+        0b1000111: lambda a, d, ram: _wrap(ram[a] - d),
+        0b1000000: lambda a, d, ram: d & ram[a],
+        0b1010101: lambda a, d, ram: d | ram[a],
+    }
+    functions = {}
+    for comp in range(1 << 7):
+        if comp in fast:
+            functions[comp] = fast[comp]
+            continue
+        bits = [(comp >> shift) & 1 for shift in range(5, -1, -1)]
+        if comp & 0b1000000:
+            functions[comp] = lambda a, d, ram, bits=bits: _alu(d, ram[a], *bits)
+        else:
+            functions[comp] = lambda a, d, ram, bits=bits: _alu(d, a, *bits)
+    return functions
+
+
+class HackEmulator:
+    """
+    Runs Hack machine code at speed.
+
+    Each ROM word is decoded once into an op tuple, the run loop only dispatches on the op kind.
+        A-instruction: (OP_A, value)
+        C-instruction: (kind, comp_fn, dest, jump), kind specialized for the common dest / jump forms.
+    RAM is a 32K array('h') of signed words. A is kept signed as well:
+    with exactly 32K words, python's negative indexing maps A to the same cell as the 15 bit address.
+    """
+    RAM_SIZE = 32768
+    SCREEN = 16384
+    KBD = 24576
+
+    OP_A = 0
+    OP_D = 1  # D=comp
+    OP_M = 2  # M=comp
+    OP_A_DEST = 3  # A=comp
+    OP_DEST = 4  # any other dest, no jump
+    OP_GOTO = 5  # 0;JMP
+    OP_JUMP = 6  # comp;Jxx, dest optional
+
+    DEST_M = 0b001
+    DEST_D = 0b010
+    DEST_A = 0b100
+
+    COMP_FUNCTIONS = _build_comp_functions()
+
+    def __init__(self, rom):
+        self.load(rom)
+        self.ram = array('h', bytes(2 * self.RAM_SIZE))
+        self.a = 0
+        self.d = 0
+        self.pc = 0
+        self.cycles = 0
+        self.halted = False
+
+    @classmethod
+    def decode(cls, word):
+        if not word & 0x8000:
+            return cls.OP_A, word
+        comp_fn = cls.COMP_FUNCTIONS[(word >> 6) & 0x7F]
+        dest = (word >> 3) & 0b111
+        jump = word & 0b111
+        if jump == 0b111 and dest == 0:
+            return cls.OP_GOTO, comp_fn, dest, jump
+        if jump:
+            return cls.OP_JUMP, comp_fn, dest, jump
+        if dest == cls.DEST_D:
+            return cls.OP_D, comp_fn, dest, jump
+        if dest == cls.DEST_M:
+            return cls.OP_M, comp_fn, dest, jump
+        if dest == cls.DEST_A:
+            return cls.OP_A_DEST, comp_fn, dest, jump
+        return cls.OP_DEST, comp_fn, dest, jump
+
+    def load(self, rom):
+        self.rom = array('H', rom)
+        self.ops = [self.decode(word) for word in self.rom]
+
+    def write_rom(self, address, word):
+        self.rom[address] = word
+        self.ops[address] = self.decode(word)
+
+    @staticmethod
+    def load_rom(path):
+        """
+        .asm (assembled in memory), .hack text, or packed little-endian binary image.
+        """
+        if path.endswith('.asm'):
+            with open(path, 'r') as rf:
+                words = dict(Assembler.iter_words(rf))
+            return [words[address] for address in range(len(words))]
+        if path.endswith('.hack'):
+            with open(path, 'r') as rf:
+                return [int(line, 2) for line in rf if line.strip()]
+        rom = array('H')
+        with open(path, 'rb') as rf:
+            rom.frombytes(rf.read())
+        if sys.byteorder != 'little':
+            rom.byteswap()
+        return rom
+
+    @classmethod
+    def from_file(cls, path):
+        return cls(cls.load_rom(path))
+
+    def reset(self):
+        # CPU reset, RAM is kept.
+        self.a = self.d = self.pc = 0
+        self.halted = False
+
+    def set_key(self, key_code):
+        self.ram[self.KBD] = key_code
+
+    def run(self, max_cycles, stop_on_halt=True, counts=None):
+        """
+        Run at most max_cycles instructions. Stops early when pc runs off the ROM,
+        or (if stop_on_halt) on an (END) @END 0;JMP loop. Returns the number of cycles executed.
+        If counts (a list / array as long as the ROM) is given, counts[pc] is incremented
+        for every instruction executed.
+        """
+        ops = self.ops
+        ram = self.ram
+        n_ops = len(ops)
+        a, d, pc = self.a, self.d, self.pc
+        op_a, op_d, op_m, op_a_dest, op_goto, op_jump = (
+            self.OP_A, self.OP_D, self.OP_M, self.OP_A_DEST, self.OP_GOTO, self.OP_JUMP
+        )
+        cycles = 0
+        while cycles < max_cycles and pc < n_ops:
+            op = ops[pc]
+            kind = op[0]
+            cycles += 1
+            if counts is not None:
+                counts[pc] += 1
+            if kind == op_a:
+                a = op[1]
+                pc += 1
+            elif kind == op_d:
+                d = op[1](a, d, ram)
+                pc += 1
+            elif kind == op_m:
+                ram[a] = op[1](a, d, ram)
+                pc += 1
+            elif kind == op_a_dest:
+                a = op[1](a, d, ram)
+                pc += 1
+            elif kind == op_goto:
+                target = a & 0x7FFF
+                # (END) @END 0;JMP: jumping back to an A-instruction that loads its own address
+                if stop_on_halt and target == pc - 1 and ops[target] == (op_a, target):
+                    self.halted = True
+                    break
+                pc = target
+            else:
+                out = op[1](a, d, ram)
+                dest = op[2]
+                target = a & 0x7FFF
+                if dest & 0b001:
+                    ram[a] = out
+                if dest & 0b010:
+                    d = out
+                if dest & 0b100:
+                    a = out
+                jump = op[3]
+                if kind == op_jump and ((jump & 0b100 and out < 0) or (jump & 0b010 and out == 0)
+                                        or (jump & 0b001 and out > 0)):
+                    pc = target
+                else:
+                    pc += 1
+
+        self.a, self.d, self.pc = a, d, pc
+        self.cycles += cycles
+        return cycles
+
+
+# comp code -> (operation, operands) over a, d and m (RAM[A]), for the block compiler
+COMP_OPERATIONS = {
+    0b0101010: ('0', ''),
+    0b0111111: ('1', ''),
+    0b0111010: ('-1', ''),
+    0b0001100: ('x', 'd'),
+    0b0110000: ('x', 'a'),
+    0b0001101: ('~x', 'd'),
+    0b0110001: ('~x', 'a'),
+    0b0001111: ('-x', 'd'),
+    0b0110011: ('-x', 'a'),
+    0b0011111: ('x+1', 'd'),
+    0b0110111: ('x+1', 'a'),
+    0b0001110: ('x-1', 'd'),
+    0b0110010: ('x-1', 'a'),
+    0b0000010: ('x+y', 'da'),
+    0b0010011: ('x-y', 'da'),
+    0b0000111: ('x-y', 'ad'),
+    0b0000000: ('x&y', 'da'),
+    0b0010101: ('x|y', 'da'),
+    0b1110000: ('x', 'm'),
+    0b1110001: ('~x', 'm'),
+    0b1110011: ('-x', 'm'),
+    0b1110111: ('x+1', 'm'),
+    0b1110010: ('x-1', 'm'),
+    0b1000010: ('x+y', 'dm'),
+    0b1010011: ('x-y', 'dm'),
+    0b1000111: ('x-y', 'md'),
+    0b1000000: ('x&y', 'dm'),
+    0b1010101: ('x|y', 'dm'),
+}
+
+# operation -> python expression over operands {x}, {y}. x is used twice by the wrap around conditionals.
+OPERATION_EXPRESSIONS = {
+    'x': '{x}',
+    '~x': '~{x}',
+    '-x': '(-{x} if {x} != -32768 else {x})',
+    'x+1': '({x} + 1 if {x} != 32767 else -32768)',
+    'x-1': '({x} - 1 if {x} != -32768 else 32767)',
+    'x+y': '{x} + {y}',
+    'x-y': '{x} - {y}',
+    'x&y': '{x} & {y}',
+    'x|y': '{x} | {y}',
+}
+
+JUMP_CONDITIONS = {
+    0b001: '{out} > 0',
+    0b010: '{out} == 0',
+    0b011: '{out} >= 0',
+    0b100: '{out} < 0',
+    0b101: '{out} != 0',
+    0b110: '{out} <= 0',
+}
+
+
+def _is_constant(value):
+    return value.lstrip('-').isdigit()
+
+
+class _BlockCompiler:
+    """
+    Generates the python lines of one block for BlockEmulator.
+
+    self.a / self.d hold what the registers are at this point of the block: a literal while the value is
+    known at compile time, otherwise the local a / d.
+    RAM words at constant addresses live in locals m<address> from their first access on. Changed ones are
+    written back to ram at the block's exits, and around an access through an unknown A whenever A
+    could be one of them (A <= the highest cached address, a single compare in the usual case).
+    """
+    def __init__(self, comp_functions):
+        self.comp_functions = comp_functions
+        self.namespace = {}
+        self.lines = []
+        self.a = 'a'
+        self.d = 'd'
+        self.cached = set()
+        self.dirty = set()
+
+    def emit(self, line, indent=1):
+        self.lines.append('    ' * indent + line)
+
+    def write_back(self, indent=1):
+        for address in sorted(self.dirty):
+            self.emit(f'ram[{address}] = m{address}', indent)
+
+    def address(self):
+        # constant address of M, None when A is only known at run time
+        return int(self.a) & 0x7FFF if _is_constant(self.a) else None
+
+    def jump_target(self):
+        if _is_constant(self.a):
+            return str(int(self.a) & 0x7FFF)
+        self.emit('target = a & 32767')
+        return 'target'
+
+    def memory(self, repeated):
+        address = self.address()
+        if address is None:
+            if self.dirty:
+                self.emit(f'if a <= {max(self.dirty)}:')
+                self.write_back(2)
+            if not repeated:
+                return 'ram[a]'
+            self.emit('m = ram[a]')
+            return 'm'
+        if address not in self.cached:
+            self.emit(f'm{address} = ram[{address}]')
+            self.cached.add(address)
+        return f'm{address}'
+
+    def comp(self, comp):
+        # python expression of the ALU output, evaluated once by the caller
+        if comp not in COMP_OPERATIONS:
+            self.namespace[f'comp_{comp}'] = self.comp_functions[comp]
+            self.write_back()
+            self.dirty.clear()
+            return f'comp_{comp}({self.a}, {self.d}, ram)'
+        operation, operands = COMP_OPERATIONS[comp]
+        if 'm' not in operands and all(_is_constant(self.a if name == 'a' else self.d) for name in operands):
+            a = int(self.a) if 'a' in operands else 0
+            d = int(self.d) if 'd' in operands else 0
+            return str(self.comp_functions[comp](a, d, None))
+        repeated = operation in ('-x', 'x+1', 'x-1')
+        values = [self.memory(repeated) if name == 'm' else getattr(self, name) for name in operands]
+        if operation in ('x+y', 'x-y') and values[1] == '0':
+            return values[0]
+        if operation == 'x+y' and values[0] == '0':
+            return values[1]
+        if operation in ('x+y', 'x-y'):
+            self.emit(f'out = {OPERATION_EXPRESSIONS[operation].format(x=values[0], y=values[1])}')
+            self.emit('if not -32768 <= out <= 32767:')
+            self.emit('out = ((out + 32768) & 65535) - 32768', 2)
+            return 'out'
+        if not operands:
+            return operation
+        return OPERATION_EXPRESSIONS[operation].format(x=values[0], y=values[-1])
+
+    def store(self, dest, value, keep=False):
+        """
+        dest bits of HackEmulator (M, D, A), in that order.
+        If keep, value is needed again afterwards and is returned as a literal or a local.
+        """
+        if (keep or dest not in (0, 1, 2, 4)) and not (_is_constant(value) or value.isidentifier()):
+            self.emit(f'out = {value}')
+            value = 'out'
+        if dest & HackEmulator.DEST_M:
+            address = self.address()
+            if address is not None:
+                self.emit(f'm{address} = {value}')
+                self.cached.add(address)
+                self.dirty.add(address)
+            elif self.cached:
+                # the store may hit a cached word: write the cache back, store, reload it
+                if not (_is_constant(value) or value.isidentifier()):
+                    self.emit(f'out = {value}')
+                    value = 'out'
+                self.emit(f'if a <= {max(self.cached)}:')
+                self.write_back(2)
+                self.emit(f'ram[a] = {value}', 2)
+                for address in sorted(self.cached):
+                    self.emit(f'm{address} = ram[{address}]', 2)
+                self.emit('else:')
+                self.emit(f'ram[a] = {value}', 2)
+            else:
+                self.emit(f'ram[a] = {value}')
+        for mask, register in ((HackEmulator.DEST_D, 'd'), (HackEmulator.DEST_A, 'a')):
+            if dest & mask:
+                if not _is_constant(value):
+                    self.emit(f'{register} = {value}')
+                setattr(self, register, value if _is_constant(value) else register)
+        return value
+
+    def exit(self, target, cycles, indent=1):
+        self.write_back(indent)
+        self.emit(f'return {self.a}, {self.d}, {target}, {cycles}', indent)
+
+
+class BlockEmulator(HackEmulator):
+    """
+    HackEmulator that compiles straight-line runs of ROM into python functions.
+
+    A block starts at whatever address control enters (jump targets are only known at run time)
+    and follows the code through unconditional jumps to constant targets, up to a jump to a computed target,
+    an address already in the block or MAX_BLOCK_LENGTH instructions; conditional jumps become early returns.
+    The generated function fn(ram, a, d) -> (a, d, pc, cycles) keeps A and D as literals while they are known,
+    so most RAM accesses become ram[constant], and keeps RAM words at constant addresses in locals
+    (see _BlockCompiler).
+    Compiled blocks are cached by start address and dropped when the ROM under them changes.
+    Whatever might not fit the cycle budget, and the final halt loop, is left to the interpreter.
+    """
+    MAX_BLOCK_LENGTH = 256
+
+    def load(self, rom):
+        super().load(rom)
+        self.blocks = {}  # start pc -> (fn, length, halts, ROM addresses the block was compiled from)
+
+    def write_rom(self, address, word):
+        super().write_rom(address, word)
+        for start, (fn, length, halts, depends) in list(self.blocks.items()):
+            if address in depends:
+                del self.blocks[start]
+
+    def is_halt_jump(self, address):
+        # 0;JMP right after an A-instruction loading its own address
+        return (self.ops[address][0] == self.OP_GOTO and address > 0
+                and self.ops[address - 1] == (self.OP_A, address - 1))
+
+    def compile_block(self, start):
+        compiler = _BlockCompiler(self.COMP_FUNCTIONS)
+        halts = self.is_halt_jump(start)
+        addresses = set()
+        depends = set()  # addresses plus the words read by is_halt_jump checks, which look one back
+        pc = start
+        while True:
+            depends.update((pc - 1, pc))
+            if (pc >= len(self.ops) or pc in addresses or len(addresses) == self.MAX_BLOCK_LENGTH
+                    or (addresses and self.is_halt_jump(pc))):
+                # fall through or jump into the next block
+                compiler.exit(pc, len(addresses))
+                break
+            addresses.add(pc)
+            word = self.rom[pc]
+            pc += 1
+            if not word & 0x8000:
+                compiler.a = str(word)
+                continue
+
+            value = compiler.comp((word >> 6) & 0x7F)
+            dest = (word >> 3) & 0b111
+            jump = word & 0b111
+            if not jump:
+                if dest:
+                    compiler.store(dest, value)
+                continue
+
+            # jump: target is the A value before this instruction's dest
+            target = compiler.jump_target()
+            value = compiler.store(dest, value, keep=jump != 0b111)
+            if jump != 0b111 and _is_constant(value):
+                jump = 0b111 if eval(JUMP_CONDITIONS[jump].format(out=value)) else 0
+            if jump == 0b111:
+                if not _is_constant(target):
+                    compiler.exit(target, len(addresses))
+                    break
+                pc = int(target)
+            elif jump:
+                compiler.emit(f'if {JUMP_CONDITIONS[jump].format(out=value)}:')
+                compiler.exit(target, len(addresses), 2)
+
+        lines = [f'def block_{start}(ram, a, d):'] + compiler.lines
+        exec(compile('\n'.join(lines), f'<hack block {start}>', 'exec'), compiler.namespace)
+        block = compiler.namespace[f'block_{start}'], len(addresses), halts, depends
+        self.blocks[start] = block
+        return block
+
+    def run(self, max_cycles, stop_on_halt=True, counts=None):
+        if counts is not None:
+            # blocks don't count single instructions
+            return super().run(max_cycles, stop_on_halt, counts)
+        blocks = self.blocks
+        ram = self.ram
+        n_ops = len(self.ops)
+        a, d, pc = self.a, self.d, self.pc
+        cycles = 0
+        while pc < n_ops:
+            fn, length, halts, _ = blocks.get(pc) or self.compile_block(pc)
+            if cycles + length > max_cycles or (halts and stop_on_halt):
+                break
+            a, d, pc, block_cycles = fn(ram, a, d)
+            cycles += block_cycles
+
+        self.a, self.d, self.pc = a, d, pc
+        self.cycles += cycles
+        if pc < n_ops and cycles < max_cycles:
+            cycles += super().run(max_cycles - cycles, stop_on_halt)
+        return cycles
+
+
+def _parse_assignment(text):
+    address, value = text.split('=')
+    return int(address), int(value)
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description='Run a Hack program (.asm, .hack or packed binary).')
+    arg_parser.add_argument('path')
+    arg_parser.add_argument('--cycles', type=int, default=10_000_000, help='cycle budget')
+    arg_parser.add_argument('--set', action='append', default=[], type=_parse_assignment,
+                            metavar='ADDRESS=VALUE', help='initial RAM value (repeatable)')
+    arg_parser.add_argument('--dump', default='0:16', help='RAM range to print afterwards, start:end')
+    arg_parser.add_argument('--blocks', action='store_true', help='compile basic blocks to python functions')
+    args = arg_parser.parse_args(argv)
+
+    emulator_class = BlockEmulator if args.blocks else HackEmulator
+    emulator = emulator_class.from_file(args.path)
+    for address, value in args.set:
+        emulator.ram[address] = value
+    start_time = time.perf_counter()
+    cycles = emulator.run(args.cycles)
+    elapsed = time.perf_counter() - start_time
+
+    start, end = (int(n) for n in args.dump.split(':'))
+    for address in range(start, end):
+        print(f'RAM[{address}] = {emulator.ram[address]}')
+    status = 'halted' if emulator.halted else f'stopped at pc={emulator.pc}'
+    print(f'{cycles} cycles, {status}, {cycles / max(elapsed, 1e-9) / 1e6:.2f}M instructions/sec')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
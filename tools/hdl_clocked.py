@@ -0,0 +1,318 @@
+import argparse
+import os
+import random
+import sys
+import time
+from array import array
+from functools import partial
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from build_cache import BuildCache  # noqa: E402
+from hack_emulator import HackEmulator  # noqa: E402
+from hdl_netlist import Netlist  # noqa: E402
+from hdl_parser import HDLLibrary  # noqa: E402
+
+
+class RegisterModel:
+    """
+    Register, ARegister, DRegister: out is the stored word, in is stored at the clock when load is set.
+
+    Models have one output, out.
+    read(*READ_INPUTS) gives out from the state and the inputs that reach it within the cycle,
+    tick(*TICK_INPUTS) updates the state at the clock.
+    """
+    READ_INPUTS = ()
+    TICK_INPUTS = ('in', 'load')
+
+    def __init__(self):
+        self.value = 0
+
+    def read(self):
+        return self.value
+
+    def tick(self, value, load):
+        if load:
+            self.value = value
+
+
+class PCModel:
+    READ_INPUTS = ()
+    TICK_INPUTS = ('in', 'load', 'inc', 'reset')
+
+    def __init__(self):
+        self.value = 0
+
+    def read(self):
+        return self.value
+
+    def tick(self, value, load, inc, reset):
+        if reset:
+            self.value = 0
+        elif load:
+            self.value = value
+        elif inc:
+            self.value = (self.value + 1) & 0xFFFF
+
+
+class RAMModel:
+    """
+    RAM8 .. RAM16K and Screen: out = memory[address] within the cycle, writes happen at the clock.
+    """
+    READ_INPUTS = ('address',)
+    TICK_INPUTS = ('in', 'load', 'address')
+
+    def __init__(self, size):
+        self.memory = array('H', bytes(2 * size))
+
+    def read(self, address):
+        return self.memory[address]
+
+    def tick(self, value, load, address):
+        if load:
+            self.memory[address] = value
+
+
+class ROMModel:
+    READ_INPUTS = ('address',)
+    TICK_INPUTS = ()
+
+    def __init__(self, size=32768):
+        self.memory = array('H', bytes(2 * size))
+
+    def load(self, words):
+        self.memory[:len(words)] = array('H', words)
+
+    def read(self, address):
+        return self.memory[address]
+
+
+class KeyboardModel:
+    READ_INPUTS = ()
+    TICK_INPUTS = ()
+
+    def __init__(self):
+        self.key = 0
+
+    def read(self):
+        return self.key
+
+
+# chip name -> model factory. Each instance of the chip gets its own model.
+MODELS = {
+    'Register': RegisterModel,
+    'ARegister': RegisterModel,
+    'DRegister': RegisterModel,
+    'PC': PCModel,
+    'RAM8': partial(RAMModel, 8),
+    'RAM64': partial(RAMModel, 64),
+    'RAM512': partial(RAMModel, 512),
+    'RAM4K': partial(RAMModel, 4096),
+    'RAM16K': partial(RAMModel, 16384),
+    'ROM32K': ROMModel,
+    'Screen': partial(RAMModel, 8192),
+    'Keyboard': KeyboardModel,
+}
+
+
+class ClockedSimulator:
+    """
+    Cycle by cycle simulation of a chip with state.
+
+    Chips named in models (all of MODELS by default) are simulated by their behavioral model,
+    everything else is flattened down to Nand gates and DFFs from its HDL.
+    Chips without HDL (ARegister, ROM32K, Screen, ...) always need their model.
+
+    The netlist is compiled into one python function per cycle: gates and model reads in topological order
+    over 0 / 1 ints, then, on a clock edge, DFFs latch their inputs and models tick.
+    """
+    def __init__(self, chip_name, library=None, models=None, cache=None):
+        model_chips = set(MODELS) if models is None else set(models)
+        self.netlist = Netlist.elaborate(chip_name, library, cache, model_chips)
+        self.models = [MODELS[name]() for name, _, _ in self.netlist.models]
+        self.dff_state = [0] * len(self.netlist.dffs)
+        self.cycles = 0
+        self._step = self._compile()
+
+    def models_of(self, chip_name):
+        # model instances of a chip, in netlist order.
+        return [model for (name, _, _), model in zip(self.netlist.models, self.models) if name == chip_name]
+
+    @staticmethod
+    def _pack(nets):
+        bits = [f'n{net}' if bit == 0 else f'n{net} << {bit}' for bit, net in enumerate(nets) if net != Netlist.FALSE]
+        return f'({" | ".join(bits)})' if bits else '0'
+
+    def _compile(self):
+        netlist = self.netlist
+        used = {net for gate in netlist.gates for net in gate[:2]}
+        used.update(d for d, _ in netlist.dffs)
+        used.update(net for _, inputs, _ in netlist.models for _, nets in inputs for net in nets)
+        used.update(net for _, nets in netlist.outputs for net in nets)
+
+        def unpack(word, nets):
+            return [f'    n{net} = {word} >> {bit} & 1' for bit, net in enumerate(nets) if net in used]
+
+        lines = ['def step(inputs, state, clock):', f'    n{Netlist.FALSE} = 0', f'    n{Netlist.TRUE} = 1']
+        for idx, (_, nets) in enumerate(netlist.inputs):
+            lines += unpack(f'inputs[{idx}]', nets)
+        if netlist.dffs:
+            lines.append(f'    {", ".join(f"n{q}" for _, q in netlist.dffs)}, = state')
+
+        nodes = [(gate[:2], gate[2:], gate) for gate in netlist.gates]
+        for idx, (_, inputs, outputs) in enumerate(netlist.models):
+            read_nets = [net for name in self.models[idx].READ_INPUTS for net in dict(inputs)[name]]
+            nodes.append((read_nets, dict(outputs)['out'], idx))
+        for node in netlist.topological_order(nodes, netlist.source_nets()):
+            if isinstance(node, tuple):
+                a, b, out = node
+                lines.append(f'    n{out} = (n{a} & n{b}) ^ 1')
+            else:
+                _, inputs, outputs = netlist.models[node]
+                args = ', '.join(self._pack(dict(inputs)[name]) for name in self.models[node].READ_INPUTS)
+                lines.append(f'    word = m{node}.read({args})')
+                lines += unpack('word', dict(outputs)['out'])
+
+        lines.append('    if clock:')
+        if netlist.dffs:
+            lines.append(f'        state[:] = [{", ".join(f"n{d}" for d, _ in netlist.dffs)}]')
+        for idx, (_, inputs, _) in enumerate(netlist.models):
+            if self.models[idx].TICK_INPUTS:
+                args = ', '.join(self._pack(dict(inputs)[name]) for name in self.models[idx].TICK_INPUTS)
+                lines.append(f'        m{idx}.tick({args})')
+        lines.append('        pass')
+        lines.append(f'    return [{", ".join(self._pack(nets) for _, nets in netlist.outputs)}]')
+
+        namespace = {f'm{idx}': model for idx, model in enumerate(self.models)}
+        exec(compile('\n'.join(lines), f'<clocked {netlist.chip_name}>', 'exec'), namespace)
+        return namespace['step']
+
+    def _input_words(self, inputs):
+        inputs = inputs or {}
+        return [inputs.get(name, 0) for name, _ in self.netlist.inputs]
+
+    def evaluate(self, inputs=None):
+        # {output pin: value} for the current state and inputs, without a clock edge.
+        words = self._step(self._input_words(inputs), self.dff_state, False)
+        return {name: word for (name, _), word in zip(self.netlist.outputs, words)}
+
+    def tick(self, inputs=None):
+        # one clock cycle. Returns the outputs as they were just before the clock edge.
+        words = self._step(self._input_words(inputs), self.dff_state, True)
+        self.cycles += 1
+        return {name: word for (name, _), word in zip(self.netlist.outputs, words)}
+
+    def run(self, n_cycles, inputs=None):
+        # n_cycles clock cycles with the same inputs.
+        step = self._step
+        words = self._input_words(inputs)
+        state = self.dff_state
+        for _ in range(n_cycles):
+            step(words, state, True)
+        self.cycles += n_cycles
+
+
+class ModelChecker:
+    """
+    Runs a chip's HDL and its behavioral model side by side on random inputs and compares the outputs
+    every cycle. Parts of the HDL keep their own models, so each level of RAM8 .. RAM16K is checked
+    against the (separately checked) models of the level below.
+    Addresses are drawn from a few values, so that written words get read back.
+    """
+    def __init__(self, chip_name, library=None, cache=None):
+        library = library or HDLLibrary()
+        self.chip_name = chip_name
+        self.hdl = ClockedSimulator(chip_name, library, set(MODELS) - {chip_name}, cache)
+        self.model = ClockedSimulator(chip_name, library, {chip_name}, cache)
+
+    def check(self, n_cycles=2000, seed=0):
+        """
+        Returns (number of cycles, first failing (cycle, inputs, expected, actual) or None).
+        """
+        rng = random.Random(seed)
+        widths = {name: len(nets) for name, nets in self.hdl.netlist.inputs}
+        addresses = [rng.getrandbits(widths['address']) for _ in range(4)] if 'address' in widths else []
+        for cycle in range(n_cycles):
+            inputs = {name: rng.getrandbits(width) for name, width in widths.items()}
+            if addresses:
+                inputs['address'] = rng.choice(addresses)
+            if 'reset' in inputs:
+                inputs['reset'] = int(rng.random() < 0.05)
+            expected = self.model.tick(inputs)
+            actual = self.hdl.tick(inputs)
+            if actual != expected:
+                return cycle + 1, (cycle, inputs, expected, actual)
+        return n_cycles, None
+
+
+def _parse_assignment(text):
+    address, value = text.split('=')
+    return int(address), int(value)
+
+
+def _memory_regions(simulator):
+    # [(base address, word array)] of the RAM16K and Screen models, as laid out in the Hack memory map.
+    regions = []
+    for chip_name, base in (('RAM16K', 0), ('Screen', 16384)):
+        regions += [(base, model.memory) for model in simulator.models_of(chip_name)[:1]]
+    return regions
+
+
+def _locate(regions, address, arg_parser, option):
+    for base, words in regions:
+        if base <= address < base + len(words):
+            return words, address - base
+    arg_parser.error(f'{option}: address {address} is not in a modeled RAM16K / Screen')
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description='Run a Hack program on Computer.hdl, simulated clock by clock.')
+    arg_parser.add_argument('path', nargs='?', help='.asm, .hack or packed binary ROM')
+    arg_parser.add_argument('--cycles', type=int, default=10_000, help='clock cycles to run')
+    arg_parser.add_argument('--gate-level', action='append', default=[], metavar='CHIP',
+                            help='simulate this chip from its HDL instead of its model (repeatable)')
+    arg_parser.add_argument('--set', action='append', default=[], type=_parse_assignment,
+                            metavar='ADDRESS=VALUE', help='initial RAM value (repeatable)')
+    arg_parser.add_argument('--dump', default=None, help='RAM range to print afterwards, start:end (default 0:16)')
+    arg_parser.add_argument('--verify', action='store_true', help='check every model against the HDL of its chip')
+    arg_parser.add_argument('--cache-dir', default=None, help='keep optimized netlists in this build cache')
+    args = arg_parser.parse_args(argv)
+
+    library = HDLLibrary()
+    cache = BuildCache(args.cache_dir) if args.cache_dir else None
+    if args.verify:
+        n_failed = 0
+        for chip_name in [name for name in MODELS if library.find_path(name)]:
+            start_time = time.perf_counter()
+            n_cycles, failure = ModelChecker(chip_name, library, cache).check()
+            elapsed = time.perf_counter() - start_time
+            status = 'ok' if failure is None else 'FAIL at cycle {} inputs {} expected {} got {}'.format(*failure)
+            print(f'{chip_name}: {n_cycles} cycles, {elapsed:.2f}s, {status}')
+            n_failed += failure is not None
+        return 1 if n_failed else 0
+    if args.path is None:
+        arg_parser.error('a program to run is needed, unless --verify')
+
+    simulator = ClockedSimulator('Computer', library, set(MODELS) - set(args.gate_level), cache)
+    simulator.models_of('ROM32K')[0].load(HackEmulator.load_rom(args.path))
+    regions = _memory_regions(simulator)
+    for address, value in args.set:
+        words, idx = _locate(regions, address, arg_parser, '--set')
+        words[idx] = value & 0xFFFF
+    if args.dump is None:
+        args.dump = '0:16' if simulator.models_of('RAM16K') else '0:0'
+    start, end = (int(n) for n in args.dump.split(':'))
+    dump = [_locate(regions, address, arg_parser, '--dump') for address in range(start, end)]
+    start_time = time.perf_counter()
+    simulator.run(args.cycles)
+    elapsed = time.perf_counter() - start_time
+
+    for address, (words, idx) in zip(range(start, end), dump):
+        value = words[idx]
+        print(f'RAM[{address}] = {value - 0x10000 if value & 0x8000 else value}')
+    print(f'{len(simulator.netlist.gates)} gates, {len(simulator.netlist.dffs)} DFFs, '
+          f'{args.cycles} cycles, {args.cycles / max(elapsed, 1e-9):.0f} cycles/sec')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,432 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from build_cache import BuildCache  # noqa: E402
+from hdl_parser import CHIP_DIRS, HDLLibrary  # noqa: E402
+
+PARSER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'hdl_parser.py')
+
+
+class Netlist:
+    """
+    A chip flattened down to builtin chips, over single bit nets.
+
+    Net 0 is constant false, net 1 constant true.
+    inputs / outputs: [(pin name, [net of bit 0, bit 1, ...])] in declaration order.
+    gates: [(a, b, out)] Nand gates. dffs: [(in, out)].
+    models: [(chip name, inputs, outputs)] instances of chips kept whole, to be simulated by behavioral models.
+    """
+    FALSE = 0
+    TRUE = 1
+
+    def __init__(self, chip_name, inputs, outputs, gates, dffs, models=None):
+        self.chip_name = chip_name
+        self.inputs = inputs
+        self.outputs = outputs
+        self.gates = gates
+        self.dffs = dffs
+        self.models = [] if models is None else models
+
+    @classmethod
+    def flatten(cls, chip_name, library=None, cache=None, model_chips=()):
+        # the chip's own parts flattened into one netlist, not optimized at the top level.
+        return _Flattener(library or HDLLibrary(), cache, model_chips).flatten(chip_name)
+
+    @classmethod
+    def elaborate(cls, chip_name, library=None, cache=None, model_chips=()):
+        """
+        Flattened and optimized netlist of a chip. Chips named in model_chips are not flattened
+        but kept as model instances.
+        If cache (BuildCache) is given, the netlist of the chip and of each chip it uses is stored under a key
+        hashing this module, the parser and every .hdl file that chip depends on,
+        so unchanged chips are loaded instead of flattened again.
+        """
+        return _Flattener(library or HDLLibrary(), cache, model_chips).elaborate(chip_name)
+
+    def save(self, path):
+        with open(path, 'w') as wf:
+            json.dump({
+                'chip': self.chip_name,
+                'inputs': self.inputs,
+                'outputs': self.outputs,
+                'gates': self.gates,
+                'dffs': self.dffs,
+                'models': self.models,
+            }, wf, separators=(',', ':'))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r') as rf:
+            data = json.load(rf)
+        return cls(
+            data['chip'],
+            [(name, nets) for name, nets in data['inputs']],
+            [(name, nets) for name, nets in data['outputs']],
+            [tuple(gate) for gate in data['gates']],
+            [tuple(dff) for dff in data['dffs']],
+            [
+                (name, [(pin, nets) for pin, nets in inputs], [(pin, nets) for pin, nets in outputs])
+                for name, inputs, outputs in data['models']
+            ],
+        )
+
+    def topological_order(self, nodes, available):
+        """
+        nodes: [(input nets, output nets, item)], available: nets known from the start.
+        Returns the items ordered so every node comes after the nodes driving its inputs.
+        Raises ValueError on a combinational loop.
+        """
+        waiting = {}  # net -> nodes waiting for it
+        ordered = []
+        ready = []
+        for node in nodes:
+            missing = {net for net in node[0] if net not in available}
+            if missing:
+                for net in missing:
+                    waiting.setdefault(net, []).append([node, missing])
+            else:
+                ready.append(node)
+        while ready:
+            node = ready.pop()
+            ordered.append(node[2])
+            for out in node[1]:
+                for entry in waiting.pop(out, ()):
+                    entry[1].discard(out)
+                    if not entry[1]:
+                        ready.append(entry[0])
+        if len(ordered) != len(nodes):
+            raise ValueError(f'{self.chip_name}: combinational loop, {len(nodes) - len(ordered)} parts never settle')
+        return ordered
+
+    def source_nets(self):
+        # nets with a value before any gate is evaluated: constants, inputs, DFF outputs.
+        available = {self.FALSE, self.TRUE}
+        for _, nets in self.inputs:
+            available.update(nets)
+        available.update(out for _, out in self.dffs)
+        return available
+
+    def topological_gates(self):
+        """
+        Gates ordered so every gate comes after the gates driving its inputs.
+        Inputs, constants, DFF outputs and model outputs are available from the start.
+        """
+        available = self.source_nets()
+        available.update(net for _, _, outputs in self.models for _, nets in outputs for net in nets)
+        return self.topological_order([(gate[:2], gate[2:], gate) for gate in self.gates], available)
+
+    def optimize(self):
+        """
+        Returns an equivalent netlist where
+            gates with constant inputs are folded: Nand(false, x) = true, Nand(true, x) = Not(x),
+            Not(Not(x)) is replaced by x and gates with the same inputs are merged,
+            gates and DFFs that reach no output are dropped,
+        and nets are renumbered densely: constants, inputs, DFF outputs, then gate outputs in topological order.
+        """
+        replaced = {}  # removed gate output -> net carrying the same value
+        inverted = {}  # inverter output -> its input
+        kept = {}  # (a, b) -> output of the kept gate
+        gates = []
+        for a, b, out in self.topological_gates():
+            a, b = sorted((replaced.get(a, a), replaced.get(b, b)))
+            if a == self.FALSE:
+                replaced[out] = self.TRUE
+                continue
+            if a == self.TRUE:
+                a = b
+                if a == self.TRUE:
+                    replaced[out] = self.FALSE
+                    continue
+            if a == b and a in inverted:
+                replaced[out] = inverted[a]
+                continue
+            if (a, b) in kept:
+                replaced[out] = kept[a, b]
+                continue
+            kept[a, b] = out
+            if a == b:
+                inverted[out] = a
+            gates.append((a, b, out))
+        dffs = [(replaced.get(d, d), q) for d, q in self.dffs]
+        outputs = [(name, [replaced.get(net, net) for net in nets]) for name, nets in self.outputs]
+        models = [
+            (chip_name, [(name, [replaced.get(net, net) for net in nets]) for name, nets in inputs], outputs)
+            for chip_name, inputs, outputs in self.models
+        ]
+        model_inputs = [net for _, inputs, _ in models for _, nets in inputs for net in nets]
+        model_outputs = [net for *_, outputs in models for _, nets in outputs for net in nets]
+
+        drivers = {out: (a, b) for a, b, out in gates}
+        drivers.update((q, (d,)) for d, q in dffs)
+        live = set()
+        # models are kept, they may hold state.
+        pending = [net for _, nets in outputs for net in nets] + model_inputs
+        while pending:
+            net = pending.pop()
+            if net not in live:
+                live.add(net)
+                pending.extend(drivers.get(net, ()))
+        gates = [gate for gate in gates if gate[2] in live]
+        dffs = [dff for dff in dffs if dff[1] in live]
+
+        numbers = {self.FALSE: self.FALSE, self.TRUE: self.TRUE}
+        ordered_nets = [net for _, nets in self.inputs for net in nets] + [q for _, q in dffs] + model_outputs
+        ordered_nets += [out for *_, out in gates]
+        # nets nothing drives (an output pin left unconnected) go last.
+        ordered_nets += [net for gate in gates for net in gate[:2]] + [d for d, _ in dffs] + model_inputs
+        ordered_nets += [net for _, nets in outputs for net in nets]
+        for net in ordered_nets:
+            numbers.setdefault(net, len(numbers))
+
+        def renumber(pins):
+            return [(name, [numbers[net] for net in nets]) for name, nets in pins]
+
+        return Netlist(
+            self.chip_name,
+            renumber(self.inputs),
+            renumber(outputs),
+            [(numbers[a], numbers[b], numbers[out]) for a, b, out in gates],
+            [(numbers[d], numbers[q]) for d, q in dffs],
+            [(chip_name, renumber(inputs), renumber(outputs)) for chip_name, inputs, outputs in models],
+        )
+
+    def depth(self):
+        # critical path: the longest chain of gates from inputs / DFF outputs to outputs / DFF inputs.
+        levels = {}
+        for a, b, out in self.topological_gates():
+            levels[out] = 1 + max(levels.get(a, 0), levels.get(b, 0))
+        return max(levels.values(), default=0)
+
+
+class _Flattener:
+    """
+    Every pin bit of the chip and of its parts gets a net, connections merge nets (union find).
+    Unconnected part inputs are tied to false, as in the HDL spec.
+
+    Parts are not expanded recursively: each chip type is elaborated once (flattened and optimized,
+    or loaded from the cache) and its netlist is copied into every instance.
+    netlists (chip name -> optimized netlist) is shared with the flatteners of the parts.
+    Chips in model_chips become model instances instead, whether they have HDL or are builtin.
+    """
+    def __init__(self, library, cache=None, model_chips=(), netlists=None, stack=()):
+        self.library = library
+        self.cache = cache
+        self.model_chips = frozenset(model_chips)
+        self.netlists = {} if netlists is None else netlists
+        self.stack = stack
+        self.parent = [Netlist.FALSE, Netlist.TRUE]
+        self.gates = []
+        self.dffs = []
+        self.models = []
+
+    def new_nets(self, n):
+        start = len(self.parent)
+        self.parent.extend(range(start, start + n))
+        return list(range(start, start + n))
+
+    def find(self, net):
+        parent = self.parent
+        while parent[net] != net:
+            parent[net] = parent[parent[net]]
+            net = parent[net]
+        return net
+
+    def union(self, a, b):
+        a, b = self.find(a), self.find(b)
+        if a == b:
+            return
+        if a <= Netlist.TRUE and b <= Netlist.TRUE:
+            raise ValueError('true and false connected together')
+        if b <= Netlist.TRUE:
+            a, b = b, a
+        # constants stay roots
+        self.parent[b] = a
+
+    def _internal_pin_widths(self, chip):
+        # internal pins are declared by the part outputs driving them.
+        widths = {}
+        chip_pins = chip.pin_widths
+        for part in chip.parts:
+            sub = self.library.get(part.chip_name)
+            sub_outputs = dict(sub.outputs)
+            for inner, outer in part.connections:
+                if inner.name not in sub_outputs or isinstance(outer, bool) or outer.name in chip_pins:
+                    continue
+                if outer.lo is not None:
+                    raise ValueError(f'{chip.name}: internal pin {outer} can not be subscripted')
+                widths[outer.name] = len(inner.bits(sub_outputs[inner.name]))
+        return widths
+
+    def _instantiate_builtin(self, chip, pin_nets):
+        if chip.name == 'Nand':
+            self.gates.append((pin_nets['a'][0], pin_nets['b'][0], pin_nets['out'][0]))
+        elif chip.name == 'DFF':
+            self.dffs.append((pin_nets['in'][0], pin_nets['out'][0]))
+        else:
+            raise NotImplementedError(f'no model for builtin chip {chip.name}')
+
+    def _instantiate_model(self, chip, pin_nets):
+        inputs = [(name, pin_nets[name]) for name, _ in chip.inputs]
+        outputs = [(name, pin_nets[name]) for name, _ in chip.outputs]
+        self.models.append((chip.name, inputs, outputs))
+
+    def _instantiate_part(self, chip, pin_nets):
+        if chip.name in self.model_chips:
+            self._instantiate_model(chip, pin_nets)
+        elif chip.builtin:
+            self._instantiate_builtin(chip, pin_nets)
+        else:
+            self._instantiate_netlist(self.elaborate(chip.name), pin_nets)
+
+    def _instantiate_netlist(self, netlist, pin_nets):
+        # nets of the part's netlist -> nets here: constants stay, pins map to pin_nets, the rest are new.
+        nets = {Netlist.FALSE: Netlist.FALSE, Netlist.TRUE: Netlist.TRUE}
+        for name, inner_nets in netlist.inputs:
+            for inner_net, net in zip(inner_nets, pin_nets[name]):
+                if inner_net in nets:
+                    self.union(nets[inner_net], net)
+                else:
+                    nets[inner_net] = net
+        inner_nets = [q for _, q in netlist.dffs] + [out for *_, out in netlist.gates]
+        inner_nets += [net for gate in netlist.gates for net in gate[:2]] + [d for d, _ in netlist.dffs]
+        inner_nets += [net for _, output_nets in netlist.outputs for net in output_nets]
+        for _, inputs, outputs in netlist.models:
+            inner_nets += [net for _, model_nets in inputs + outputs for net in model_nets]
+        inner_nets = [net for net in dict.fromkeys(inner_nets) if net not in nets]
+        nets.update(zip(inner_nets, self.new_nets(len(inner_nets))))
+
+        def map_pins(pins):
+            return [(name, [nets[net] for net in model_nets]) for name, model_nets in pins]
+
+        self.gates.extend((nets[a], nets[b], nets[out]) for a, b, out in netlist.gates)
+        self.dffs.extend((nets[d], nets[q]) for d, q in netlist.dffs)
+        self.models.extend((name, map_pins(inputs), map_pins(outputs)) for name, inputs, outputs in netlist.models)
+        for name, inner_nets in netlist.outputs:
+            for inner_net, net in zip(inner_nets, pin_nets[name]):
+                self.union(nets[inner_net], net)
+
+    def elaborate(self, chip_name):
+        if chip_name in self.netlists:
+            return self.netlists[chip_name]
+        if chip_name in self.stack:
+            raise ValueError(f'{chip_name} contains itself: {" > ".join(self.stack + (chip_name,))}')
+        flattener = _Flattener(self.library, self.cache, self.model_chips, self.netlists, self.stack + (chip_name,))
+        if self.cache is None:
+            netlist = flattener.flatten(chip_name).optimize()
+        else:
+            dependencies = self.library.dependencies(chip_name)
+            input_paths = [PARSER_PATH] + [chip.path for chip in dependencies if chip.path]
+            models = sorted(chip.name for chip in dependencies if chip.name in self.model_chips)
+            key = self.cache.make_key(__file__, input_paths, {'chip': chip_name, 'models': models})
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                path = os.path.join(tmp_dir, 'netlist.json')
+                if self.cache.get(key, [path]):
+                    netlist = Netlist.load(path)
+                else:
+                    netlist = flattener.flatten(chip_name).optimize()
+                    netlist.save(path)
+                    self.cache.put(key, [path])
+        self.netlists[chip_name] = netlist
+        return netlist
+
+    def instantiate(self, chip, pin_nets):
+        local = dict(pin_nets)
+        for name, width in self._internal_pin_widths(chip).items():
+            local[name] = self.new_nets(width)
+
+        for part in chip.parts:
+            sub = self.library.get(part.chip_name)
+            sub_widths = sub.pin_widths
+            sub_nets = {name: self.new_nets(width) for name, width in sub_widths.items()}
+            connected = set()
+            for inner, outer in part.connections:
+                if inner.name not in sub_widths:
+                    raise ValueError(f'{chip.name}: {sub.name} has no pin {inner.name}')
+                connected.add(inner.name)
+                inner_nets = [sub_nets[inner.name][bit] for bit in inner.bits(sub_widths[inner.name])]
+                if isinstance(outer, bool):
+                    constant = Netlist.TRUE if outer else Netlist.FALSE
+                    for net in inner_nets:
+                        self.union(net, constant)
+                    continue
+                if outer.name not in local:
+                    raise ValueError(f'{chip.name}: pin {outer.name} is not declared or driven by any part')
+                outer_nets = local[outer.name]
+                outer_nets = [outer_nets[bit] for bit in outer.bits(len(outer_nets))]
+                if len(inner_nets) != len(outer_nets):
+                    raise ValueError(f'{chip.name}: width mismatch in {sub.name}({inner}={outer})')
+                for inner_net, outer_net in zip(inner_nets, outer_nets):
+                    self.union(inner_net, outer_net)
+            for name, _ in sub.inputs:
+                if name not in connected:
+                    for net in sub_nets[name]:
+                        self.union(net, Netlist.FALSE)
+            self._instantiate_part(sub, sub_nets)
+
+    def flatten(self, chip_name):
+        chip = self.library.get(chip_name)
+        pin_nets = {name: self.new_nets(width) for name, width in chip.inputs + chip.outputs}
+        if chip.builtin or chip.name in self.model_chips:
+            self._instantiate_part(chip, pin_nets)
+        else:
+            self.instantiate(chip, pin_nets)
+
+        find = self.find
+
+        def find_pins(pins):
+            return [(name, [find(net) for net in nets]) for name, nets in pins]
+
+        gates = [(find(a), find(b), find(out)) for a, b, out in self.gates]
+        dffs = [(find(d), find(q)) for d, q in self.dffs]
+        models = [(name, find_pins(inputs), find_pins(outputs)) for name, inputs, outputs in self.models]
+        driven = set()
+        model_outputs = [net for *_, outputs in models for _, nets in outputs for net in nets]
+        for out in [gate[2] for gate in gates] + [q for _, q in dffs] + model_outputs:
+            if out in driven or out <= Netlist.TRUE:
+                raise ValueError(f'{chip_name}: a net has more than one driver')
+            driven.add(out)
+        inputs = find_pins((name, pin_nets[name]) for name, _ in chip.inputs)
+        outputs = find_pins((name, pin_nets[name]) for name, _ in chip.outputs)
+        if any(net in driven for _, nets in inputs for net in nets):
+            raise ValueError(f'{chip_name}: an input pin is driven by a part')
+        return Netlist(chip.name, inputs, outputs, gates, dffs, models)
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description='Flatten and optimize chips, report gate counts and depth.')
+    arg_parser.add_argument('chips', nargs='*', help='chip names or .hdl paths (default: every chip in the chapters)')
+    arg_parser.add_argument('--cache-dir', default=None, help='keep optimized netlists in this build cache')
+    arg_parser.add_argument('--model', action='append', default=[], help='keep this chip whole, not counted as gates')
+    args = arg_parser.parse_args(argv)
+
+    library = HDLLibrary()
+    cache = BuildCache(args.cache_dir) if args.cache_dir else None
+    # builtin chips without gates (ARegister, ROM32K, Screen, ...) are always kept whole.
+    model_chips = [name for name, chip in library.BUILTIN_CHIPS.items() if name not in ('Nand', 'DFF')] + args.model
+    chip_names = []
+    for chip in args.chips or sorted(name[:-4] for chip_dir in CHIP_DIRS for name in os.listdir(chip_dir)):
+        chip_names.append(library.load_file(chip).name if chip.endswith('.hdl') else chip)
+
+    for chip_name in chip_names:
+        start_time = time.perf_counter()
+        try:
+            netlist = Netlist.elaborate(chip_name, library, cache, model_chips)
+        except (KeyError, NotImplementedError, ValueError) as error:
+            print(f'{chip_name}: skipped, {error.args[0]}')
+            continue
+        elapsed = time.perf_counter() - start_time
+        models = f', {len(netlist.models)} models' if netlist.models else ''
+        print(
+            f'{chip_name}: {len(netlist.gates)} gates, {len(netlist.dffs)} DFFs{models}, '
+            f'depth {netlist.depth()}, {elapsed:.2f}s'
+        )
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
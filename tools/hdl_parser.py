@@ -0,0 +1,233 @@
+import os
+import re
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+CHIP_DIRS = [os.path.join(ROOT_DIR, name) for name in ('01_basic_gates', '02_ALU', '03_RAM-PC', '05_Computer')]
+
+
+class HDLSyntaxError(Exception):
+    pass
+
+
+class PinRef:
+    """
+    name, name[i] or name[lo..hi] (inclusive). lo / hi are None for the whole pin.
+    """
+    def __init__(self, name, lo=None, hi=None):
+        self.name = name
+        self.lo = lo
+        self.hi = hi
+
+    def bits(self, width):
+        # bit indices this reference covers, on a pin of the given width.
+        if self.lo is None:
+            return list(range(width))
+        if not 0 <= self.lo <= self.hi < width:
+            raise ValueError(f'{self} out of range for width {width}')
+        return list(range(self.lo, self.hi + 1))
+
+    def __repr__(self):
+        if self.lo is None:
+            return self.name
+        if self.lo == self.hi:
+            return f'{self.name}[{self.lo}]'
+        return f'{self.name}[{self.lo}..{self.hi}]'
+
+
+class Part:
+    """
+    One chip instance inside PARTS.
+    connections: [(pin of the part, PinRef of the enclosing chip or True / False)]
+    """
+    def __init__(self, chip_name, connections):
+        self.chip_name = chip_name
+        self.connections = connections
+
+
+class ChipDefinition:
+    """
+    inputs / outputs: [(pin name, width)] in declaration order.
+    parts: [Part], empty for builtin chips.
+    """
+    def __init__(self, name, inputs, outputs, parts, path=None, builtin=False, clocked=False):
+        self.name = name
+        self.inputs = inputs
+        self.outputs = outputs
+        self.parts = parts
+        self.path = path
+        self.builtin = builtin
+        self.clocked = clocked
+
+    @property
+    def pin_widths(self):
+        return dict(self.inputs + self.outputs)
+
+
+class HDLParser:
+    """
+    CHIP Name { IN pin, bus[16]; OUT pin; PARTS: Chip(a=x, b=y[0..7], out=z); ... }
+    // and /* */ comments are skipped.
+    """
+    TOKEN_PATTERN = re.compile(r'\s+|//[^\n]*|/\*.*?\*/|(\.\.|[A-Za-z_][\w.]*|\d+|[{}()\[\],;=:])', re.DOTALL)
+
+    def __init__(self):
+        self.tokens = []
+        self.position = 0
+        self.path = None
+
+    def _tokenize(self, text):
+        tokens = []
+        position = 0
+        while position < len(text):
+            match = self.TOKEN_PATTERN.match(text, position)
+            if match is None:
+                raise HDLSyntaxError(f'{self.path}: unexpected character {text[position]!r}')
+            if match.group(1) is not None:
+                tokens.append(match.group(1))
+            position = match.end()
+        return tokens
+
+    def _peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def _next(self, expected=None):
+        token = self._peek()
+        if token is None or (expected is not None and token != expected):
+            raise HDLSyntaxError(f'{self.path}: expected {expected or "more input"}, got {token!r}')
+        self.position += 1
+        return token
+
+    def _number(self):
+        token = self._next()
+        if not token.isdigit():
+            raise HDLSyntaxError(f'{self.path}: expected a number, got {token!r}')
+        return int(token)
+
+    def _pin_declarations(self, keyword):
+        self._next(keyword)
+        pins = []
+        while True:
+            name = self._next()
+            width = 1
+            if self._peek() == '[':
+                self._next('[')
+                width = self._number()
+                self._next(']')
+            pins.append((name, width))
+            if self._next() == ';':
+                return pins
+
+    def _pin_ref(self):
+        name = self._next()
+        if self._peek() != '[':
+            return PinRef(name)
+        self._next('[')
+        lo = hi = self._number()
+        if self._peek() == '..':
+            self._next('..')
+            hi = self._number()
+        self._next(']')
+        return PinRef(name, lo, hi)
+
+    def _part(self):
+        chip_name = self._next()
+        self._next('(')
+        connections = []
+        while True:
+            inner = self._pin_ref()
+            self._next('=')
+            outer = self._pin_ref()
+            if outer.name in ('true', 'false') and outer.lo is None:
+                outer = outer.name == 'true'
+            connections.append((inner, outer))
+            if self._next() == ')':
+                break
+        self._next(';')
+        return Part(chip_name, connections)
+
+    def parse(self, text, path=None):
+        self.path = path
+        self.tokens = self._tokenize(text)
+        self.position = 0
+        self._next('CHIP')
+        name = self._next()
+        self._next('{')
+        inputs = self._pin_declarations('IN') if self._peek() == 'IN' else []
+        outputs = self._pin_declarations('OUT') if self._peek() == 'OUT' else []
+        parts = []
+        if self._peek() == 'PARTS':
+            self._next('PARTS')
+            self._next(':')
+            while self._peek() != '}':
+                parts.append(self._part())
+        self._next('}')
+        return ChipDefinition(name, inputs, outputs, parts, path)
+
+    def parse_file(self, path):
+        with open(path, 'r') as rf:
+            return self.parse(rf.read(), path)
+
+
+class HDLLibrary:
+    """
+    Finds and parses chips by name: <Name>.hdl in search_dirs (the chapter directories by default),
+    and the builtin chips below that have no HDL. Parsed chips are kept.
+    Only Nand and DFF are simulated at gate level, the others need a behavioral model (hdl_clocked.MODELS).
+    """
+    BUILTIN_CHIPS = {
+        'Nand': ChipDefinition('Nand', [('a', 1), ('b', 1)], [('out', 1)], [], builtin=True),
+        'DFF': ChipDefinition('DFF', [('in', 1)], [('out', 1)], [], builtin=True, clocked=True),
+        'ARegister': ChipDefinition(
+            'ARegister', [('in', 16), ('load', 1)], [('out', 16)], [], builtin=True, clocked=True
+        ),
+        'DRegister': ChipDefinition(
+            'DRegister', [('in', 16), ('load', 1)], [('out', 16)], [], builtin=True, clocked=True
+        ),
+        'ROM32K': ChipDefinition('ROM32K', [('address', 15)], [('out', 16)], [], builtin=True),
+        'Screen': ChipDefinition(
+            'Screen', [('in', 16), ('load', 1), ('address', 13)], [('out', 16)], [], builtin=True, clocked=True
+        ),
+        'Keyboard': ChipDefinition('Keyboard', [], [('out', 16)], [], builtin=True),
+    }
+
+    def __init__(self, search_dirs=None):
+        self.search_dirs = CHIP_DIRS if search_dirs is None else search_dirs
+        self.chips = dict(self.BUILTIN_CHIPS)
+        self.parser = HDLParser()
+
+    def find_path(self, name):
+        for search_dir in self.search_dirs:
+            path = os.path.join(search_dir, f'{name}.hdl')
+            if os.path.exists(path):
+                return path
+        return None
+
+    def get(self, name):
+        if name not in self.chips:
+            path = self.find_path(name)
+            if path is None:
+                raise KeyError(f'chip {name} not found in {self.search_dirs}')
+            self.chips[name] = self.parser.parse_file(path)
+        return self.chips[name]
+
+    def dependencies(self, name):
+        """
+        The chip and every chip used by its parts, directly or not, each once, in depth first order.
+        """
+        chips = []
+        seen = set()
+        pending = [name]
+        while pending:
+            chip = self.get(pending.pop())
+            if chip.name in seen:
+                continue
+            seen.add(chip.name)
+            chips.append(chip)
+            pending.extend(part.chip_name for part in reversed(chip.parts))
+        return chips
+
+    def load_file(self, path):
+        # parse a chip from an explicit path; its parts are still looked up by name.
+        chip = self.parser.parse_file(path)
+        self.chips[chip.name] = chip
+        return chip
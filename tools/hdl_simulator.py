@@ -0,0 +1,239 @@
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from build_cache import BuildCache  # noqa: E402
+from hdl_netlist import Netlist  # noqa: E402
+from hdl_parser import HDLLibrary  # noqa: E402
+
+
+def pack_lanes(values, width):
+    """
+    values (one per test vector) -> [lane of bit 0, lane of bit 1, ...],
+    where bit v of a lane is that bit of values[v].
+    """
+    lanes = []
+    for bit in range(width):
+        lanes.append(int(''.join('1' if (value >> bit) & 1 else '0' for value in reversed(values)) or '0', 2))
+    return lanes
+
+
+def unpack_lanes(lanes, n_vectors):
+    # inverse of pack_lanes.
+    values = [0] * n_vectors
+    for bit, lane in enumerate(lanes):
+        digits = format(lane, f'0{n_vectors}b')[::-1]
+        for vector in range(n_vectors):
+            if digits[vector] == '1':
+                values[vector] |= 1 << bit
+    return values
+
+
+def counter_lanes(n_bits):
+    """
+    Lanes of every input combination of n_bits: vector v holds the value v, so bit k of the counter
+    is a square wave of period 2 ** (k + 1) across the 2 ** n_bits lanes.
+    """
+    n_vectors = 1 << n_bits
+    all_lanes = (1 << n_vectors) - 1
+    lanes = []
+    for bit in range(n_bits):
+        half_period = 1 << bit
+        period_pattern = ((1 << half_period) - 1) << half_period
+        lanes.append(period_pattern * (all_lanes // ((1 << (2 * half_period)) - 1)))
+    return lanes
+
+
+class CombinationalSimulator:
+    """
+    Bit-parallel evaluation of a combinational chip.
+
+    The optimized netlist (Netlist.elaborate) is sorted topologically and compiled into one python function,
+    a line per Nand gate over python ints. Every int carries one bit per test vector (a lane),
+    so a single ~(a & b) evaluates a gate for all vectors at once, however many there are.
+    """
+    def __init__(self, netlist):
+        if netlist.dffs:
+            raise ValueError(f'{netlist.chip_name} has DFFs, it is not combinational')
+        self.netlist = netlist
+        self._evaluate = self._compile(netlist)
+
+    @classmethod
+    def from_chip(cls, chip_name, library=None, cache=None):
+        return cls(Netlist.elaborate(chip_name, library, cache))
+
+    @staticmethod
+    def _compile(netlist):
+        input_nets = [net for _, nets in netlist.inputs for net in nets]
+        lines = ['def evaluate(inputs):', f'    n{Netlist.FALSE} = 0', f'    n{Netlist.TRUE} = -1']
+        if input_nets:
+            # a net can appear twice if the HDL ties input bits together, the last one wins.
+            lines.append(f'    {", ".join(f"n{net}" for net in input_nets)}, = inputs')
+        for a, b, out in netlist.topological_gates():
+            lines.append(f'    n{out} = ~(n{a} & n{b})')
+        output_nets = [net for _, nets in netlist.outputs for net in nets]
+        lines.append(f'    return [{", ".join(f"n{net}" for net in output_nets)}]')
+        namespace = {}
+        exec(compile('\n'.join(lines), f'<chip {netlist.chip_name}>', 'exec'), namespace)
+        return namespace['evaluate']
+
+    def evaluate_lanes(self, input_lanes, n_vectors):
+        """
+        input_lanes: {pin: [lane per bit]} (missing pins are false).
+        Returns {pin: [lane per bit]} for the outputs, trimmed to n_vectors lanes.
+        """
+        flat = []
+        for name, nets in self.netlist.inputs:
+            lanes = input_lanes.get(name, [0] * len(nets))
+            if len(lanes) != len(nets):
+                raise ValueError(f'pin {name} has {len(nets)} bits, got {len(lanes)} lanes')
+            flat.extend(lanes)
+        mask = (1 << n_vectors) - 1
+        flat_outputs = iter(self._evaluate(flat))
+        return {name: [next(flat_outputs) & mask for _ in nets] for name, nets in self.netlist.outputs}
+
+    def evaluate(self, vectors):
+        # [{input pin: value}] -> [{output pin: value}], pin values unsigned.
+        input_lanes = {
+            name: pack_lanes([vector.get(name, 0) for vector in vectors], len(nets))
+            for name, nets in self.netlist.inputs
+        }
+        output_lanes = self.evaluate_lanes(input_lanes, len(vectors))
+        outputs = [{} for _ in vectors]
+        for name, lanes in output_lanes.items():
+            for output, value in zip(outputs, unpack_lanes(lanes, len(vectors))):
+                output[name] = value
+        return outputs
+
+
+def _mux(sel, *inputs):
+    return inputs[sel]
+
+
+def _alu(x, y, zx, nx, zy, ny, f, no):
+    x = 0 if zx else x
+    x = x ^ 0xFFFF if nx else x
+    y = 0 if zy else y
+    y = y ^ 0xFFFF if ny else y
+    out = (x + y) & 0xFFFF if f else x & y
+    out = out ^ 0xFFFF if no else out
+    return {'out': out, 'zr': int(out == 0), 'ng': out >> 15}
+
+
+# chip name -> fn(**input pins) -> {output pin: value}, the expected behavior of the combinational chips.
+REFERENCE_MODELS = {
+    'Nand': lambda a, b: {'out': 1 - (a & b)},
+    'Not': lambda **pins: {'out': 1 - pins['in']},
+    'And': lambda a, b: {'out': a & b},
+    'Or': lambda a, b: {'out': a | b},
+    'Xor': lambda a, b: {'out': a ^ b},
+    'Mux': lambda a, b, sel: {'out': _mux(sel, a, b)},
+    'DMux': lambda sel, **pins: {'a': pins['in'] if sel == 0 else 0, 'b': pins['in'] if sel == 1 else 0},
+    'Not16': lambda **pins: {'out': pins['in'] ^ 0xFFFF},
+    'And16': lambda a, b: {'out': a & b},
+    'Or16': lambda a, b: {'out': a | b},
+    'Mux16': lambda a, b, sel: {'out': _mux(sel, a, b)},
+    'Or8Way': lambda **pins: {'out': int(pins['in'] != 0)},
+    'Mux4Way16': lambda a, b, c, d, sel: {'out': _mux(sel, a, b, c, d)},
+    'Mux8Way16': lambda a, b, c, d, e, f, g, h, sel: {'out': _mux(sel, a, b, c, d, e, f, g, h)},
+    'DMux4Way': lambda sel, **pins: {name: pins['in'] if sel == idx else 0 for idx, name in enumerate('abcd')},
+    'DMux8Way': lambda sel, **pins: {name: pins['in'] if sel == idx else 0 for idx, name in enumerate('abcdefgh')},
+    'HalfAdder': lambda a, b: {'sum': a ^ b, 'carry': a & b},
+    'FullAdder': lambda a, b, c: {'sum': (a + b + c) & 1, 'carry': (a + b + c) >> 1},
+    'Add16': lambda a, b: {'out': (a + b) & 0xFFFF},
+    'Inc16': lambda **pins: {'out': (pins['in'] + 1) & 0xFFFF},
+    'ALU': _alu,
+}
+
+
+class ChipChecker:
+    """
+    Compares a chip against its REFERENCE_MODELS entry, over every input combination
+    when there are at most exhaustive_bits input bits, otherwise over n_random random vectors.
+    """
+    def __init__(self, simulator, reference=None):
+        self.simulator = simulator
+        self.reference = reference or REFERENCE_MODELS[simulator.netlist.chip_name]
+
+    def _exhaustive_vectors(self):
+        inputs = self.simulator.netlist.inputs
+        n_bits = sum(len(nets) for _, nets in inputs)
+        lanes = counter_lanes(n_bits)
+        input_lanes = {}
+        vectors = [{} for _ in range(1 << n_bits)]
+        shift = 0
+        for name, nets in inputs:
+            input_lanes[name] = lanes[shift:shift + len(nets)]
+            mask = (1 << len(nets)) - 1
+            for value, vector in enumerate(vectors):
+                vector[name] = (value >> shift) & mask
+            shift += len(nets)
+        return vectors, input_lanes
+
+    def _random_vectors(self, n_random, seed):
+        rng = random.Random(seed)
+        vectors = [
+            {name: rng.getrandbits(len(nets)) for name, nets in self.simulator.netlist.inputs} for _ in range(n_random)
+        ]
+        input_lanes = {
+            name: pack_lanes([vector[name] for vector in vectors], len(nets))
+            for name, nets in self.simulator.netlist.inputs
+        }
+        return vectors, input_lanes
+
+    def check(self, exhaustive_bits=20, n_random=100_000, seed=0):
+        """
+        Returns (number of vectors, first failing (inputs, expected, actual) or None).
+        """
+        n_bits = sum(len(nets) for _, nets in self.simulator.netlist.inputs)
+        if n_bits <= exhaustive_bits:
+            vectors, input_lanes = self._exhaustive_vectors()
+        else:
+            vectors, input_lanes = self._random_vectors(n_random, seed)
+        output_lanes = self.simulator.evaluate_lanes(input_lanes, len(vectors))
+
+        expected = [self.reference(**vector) for vector in vectors]
+        failing = 0
+        for name, lanes in output_lanes.items():
+            expected_lanes = pack_lanes([outputs[name] for outputs in expected], len(lanes))
+            for lane, expected_lane in zip(lanes, expected_lanes):
+                failing |= lane ^ expected_lane
+        if not failing:
+            return len(vectors), None
+        first = (failing & -failing).bit_length() - 1
+        actual = {name: unpack_lanes([lane >> first for lane in lanes], 1)[0] for name, lanes in output_lanes.items()}
+        return len(vectors), (vectors[first], expected[first], actual)
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description='Check combinational chips against reference models.')
+    arg_parser.add_argument('chips', nargs='*', help='chip names or .hdl paths (default: every chip with a model)')
+    arg_parser.add_argument('--exhaustive-bits', type=int, default=20, help='exhaustive up to this many input bits')
+    arg_parser.add_argument('--random', type=int, default=100_000, help='random vectors for wider chips')
+    arg_parser.add_argument('--seed', type=int, default=0)
+    arg_parser.add_argument('--cache-dir', default=None, help='keep optimized netlists in this build cache')
+    args = arg_parser.parse_args(argv)
+
+    library = HDLLibrary()
+    cache = BuildCache(args.cache_dir) if args.cache_dir else None
+    chip_names = []
+    for chip in args.chips or [name for name in REFERENCE_MODELS if library.find_path(name)]:
+        chip_names.append(library.load_file(chip).name if chip.endswith('.hdl') else chip)
+
+    n_failed = 0
+    for chip_name in chip_names:
+        start_time = time.perf_counter()
+        simulator = CombinationalSimulator.from_chip(chip_name, library, cache)
+        n_vectors, failure = ChipChecker(simulator).check(args.exhaustive_bits, args.random, args.seed)
+        elapsed = time.perf_counter() - start_time
+        status = 'ok' if failure is None else f'FAIL inputs {failure[0]} expected {failure[1]} got {failure[2]}'
+        print(f'{chip_name}: {len(simulator.netlist.gates)} gates, {n_vectors} vectors, {elapsed:.2f}s, {status}')
+        n_failed += failure is not None
+    return 1 if n_failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
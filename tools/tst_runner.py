@@ -0,0 +1,444 @@
+import argparse
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from glob import glob
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from build_cache import BuildCache  # noqa: E402
+from hack_emulator import HackEmulator  # noqa: E402
+from hdl_clocked import MODELS, ClockedSimulator  # noqa: E402
+from hdl_parser import CHIP_DIRS, ROOT_DIR, HDLLibrary  # noqa: E402
+
+# chapters with .tst scripts: the chip directories and the assembly programs.
+SCRIPT_DIRS = sorted(CHIP_DIRS + [os.path.join(ROOT_DIR, '04_Low_level_programming')])
+
+
+class TestScriptError(Exception):
+    pass
+
+
+class OutputColumn:
+    """
+    One output-list entry, name%<format><left pad>.<width>.<right pad>, e.g. in%B3.16.3 or RAM[0]%D2.6.2.
+    Formats: B binary, X hex, D decimal (right aligned, signed for 16 bit values), S string (left aligned).
+    """
+    PATTERN = re.compile(r'^([^%]+)(?:%([BXDS])(\d+)\.(\d+)\.(\d+))?$')
+
+    def __init__(self, spec):
+        match = self.PATTERN.match(spec)
+        if match is None:
+            raise TestScriptError(f'bad output-list entry {spec!r}')
+        self.name = match.group(1)
+        self.format = match.group(2) or 'B'
+        self.pad_left, self.width, self.pad_right = (1, 1, 1)
+        if match.group(2):
+            self.pad_left, self.width, self.pad_right = (int(n) for n in match.group(3, 4, 5))
+
+    def header(self):
+        total = self.pad_left + self.width + self.pad_right
+        name = self.name[:total]
+        left = (total - len(name)) // 2
+        return ' ' * left + name + ' ' * (total - left - len(name))
+
+    def cell(self, value, bits):
+        if self.format == 'S':
+            text = str(value).ljust(self.width)
+        elif self.format == 'D':
+            if bits == 16 and value & 0x8000:
+                value -= 0x10000
+            text = str(value).rjust(self.width)
+        elif self.format == 'X':
+            text = format(value & ((1 << 4 * self.width) - 1), f'0{self.width}X')
+        else:
+            text = format(value & ((1 << self.width) - 1), f'0{self.width}b')
+        return ' ' * self.pad_left + text[-self.width:] + ' ' * self.pad_right
+
+
+class TestScriptParser:
+    """
+    .tst script -> [command], a command is a tuple (name, *args):
+        ('load', file), ('output-file', file), ('compare-to', file), ('output-list', [OutputColumn]),
+        ('set', target, value), ('eval',), ('tick',), ('tock',), ('ticktock',), ('output',),
+        ('rom-load', file) for `ROM32K load file`, ('repeat', count, [command]), count None for ever.
+    echo / clear-echo / breakpoints are skipped, `,` and `;` both separate commands.
+    """
+    TOKEN_PATTERN = re.compile(r'\s+|//[^\n]*|/\*.*?\*/|("[^"]*"|[{},;]|[^\s{},;]+)', re.DOTALL)
+    SIMPLE_COMMANDS = ('eval', 'tick', 'tock', 'ticktock', 'output')
+    SKIPPED_COMMANDS = {'echo': 1, 'clear-echo': 0, 'breakpoint': 2, 'clear-breakpoints': 0}
+
+    def __init__(self):
+        self.tokens = []
+        self.position = 0
+        self.path = None
+
+    def _tokenize(self, text):
+        tokens = []
+        position = 0
+        while position < len(text):
+            match = self.TOKEN_PATTERN.match(text, position)
+            if match.group(1) is not None:
+                tokens.append(match.group(1))
+            position = match.end()
+        return tokens
+
+    def _next(self):
+        if self.position >= len(self.tokens):
+            raise TestScriptError(f'{self.path}: unexpected end of script')
+        self.position += 1
+        return self.tokens[self.position - 1]
+
+    def _commands(self, until=None):
+        commands = []
+        while self.position < len(self.tokens):
+            token = self._next()
+            if token in (',', ';'):
+                continue
+            if token == until:
+                return commands
+            commands.append(self._command(token))
+        if until is not None:
+            raise TestScriptError(f'{self.path}: missing {until}')
+        return commands
+
+    def _command(self, token):
+        if token in self.SIMPLE_COMMANDS:
+            return (token,)
+        if token in ('load', 'output-file', 'compare-to'):
+            return token, self._next()
+        if token == 'set':
+            return token, self._next(), parse_value(self._next())
+        if token == 'output-list':
+            columns = []
+            while self.position < len(self.tokens) and self.tokens[self.position] not in (',', ';'):
+                columns.append(OutputColumn(self._next()))
+            return token, columns
+        if token == 'repeat':
+            count = self._next()
+            if count != '{':
+                count = parse_value(count)
+                if self._next() != '{':
+                    raise TestScriptError(f'{self.path}: expected {{ after repeat {count}')
+            else:
+                count = None
+            return token, count, self._commands(until='}')
+        if token == 'ROM32K' and self._next() == 'load':
+            return 'rom-load', self._next()
+        if token in self.SKIPPED_COMMANDS:
+            for _ in range(self.SKIPPED_COMMANDS[token]):
+                self._next()
+            return ('skip',)
+        raise TestScriptError(f'{self.path}: unsupported command {token!r}')
+
+    def parse(self, text, path=None):
+        self.path = path
+        self.tokens = self._tokenize(text)
+        self.position = 0
+        return self._commands()
+
+    def parse_file(self, path):
+        with open(path, 'r') as rf:
+            return self.parse(rf.read(), path)
+
+
+def parse_value(token):
+    # 5, -1, %B0101, %XFF, %D-3
+    if token.startswith('%'):
+        base = {'B': 2, 'X': 16, 'D': 10}.get(token[1:2].upper())
+        if base is None:
+            raise TestScriptError(f'bad value {token!r}')
+        return int(token[2:], base)
+    return int(token)
+
+
+class ChipTarget:
+    """
+    A chip loaded from HDL, simulated by ClockedSimulator. Its parts use the behavioral models in MODELS
+    (they are checked by their own scripts), the chip itself always runs from its HDL.
+    Chip[] / Chip[i] read and set the value / memory word i of the first model instance of Chip,
+    e.g. RAM16K[0] or DRegister[] in Computer / CPU scripts.
+    tick samples the inputs and shows the outputs from before the clock edge, tock shows them after.
+    """
+    MODEL_PATTERN = re.compile(r'^(\w+)\[(\d*)\]$')
+
+    def __init__(self, hdl_path, library=None, cache=None):
+        library = library or HDLLibrary()
+        chip = library.load_file(hdl_path)
+        self.simulator = ClockedSimulator(chip.name, library, set(MODELS) - {chip.name}, cache)
+        self.input_bits = {name: len(nets) for name, nets in self.simulator.netlist.inputs}
+        self.output_bits = {name: len(nets) for name, nets in self.simulator.netlist.outputs}
+        self.inputs = dict.fromkeys(self.input_bits, 0)
+        self.outputs = self.simulator.evaluate(self.inputs)
+        self.time = 0
+        self.half_cycle = False
+
+    def _model(self, name):
+        match = self.MODEL_PATTERN.match(name)
+        if match is None:
+            return None, None
+        models = self.simulator.models_of(match.group(1))
+        if not models:
+            raise TestScriptError(f'no {match.group(1)} part to access as {name}')
+        return models[0], int(match.group(2)) if match.group(2) else None
+
+    def set(self, name, value):
+        if name in self.input_bits:
+            self.inputs[name] = value & ((1 << self.input_bits[name]) - 1)
+            return
+        model, address = self._model(name)
+        if model is None:
+            raise TestScriptError(f'{name} is not an input pin')
+        if address is None:
+            model.value = value & 0xFFFF
+        else:
+            model.memory[address] = value & 0xFFFF
+
+    def get(self, name):
+        # (value, bits)
+        if name == 'time':
+            return f'{self.time}+' if self.half_cycle else str(self.time), None
+        if name in self.output_bits:
+            return self.outputs[name], self.output_bits[name]
+        if name in self.input_bits:
+            return self.inputs[name], self.input_bits[name]
+        model, address = self._model(name)
+        if model is None:
+            raise TestScriptError(f'{name} is not a pin')
+        return (model.value if address is None else model.memory[address]), 16
+
+    def eval(self):
+        self.outputs = self.simulator.evaluate(self.inputs)
+
+    def tick(self):
+        self.outputs = self.simulator.tick(self.inputs)
+        self.half_cycle = True
+
+    def tock(self):
+        self.outputs = self.simulator.evaluate(self.inputs)
+        self.time += 1
+        self.half_cycle = False
+
+    def ticktock(self):
+        self.tick()
+        self.tock()
+
+
+class CPUTarget:
+    """
+    A .hack / .asm program on HackEmulator, as in the CPU emulator scripts: RAM[i], A, D, PC and ticktock.
+    """
+    RAM_PATTERN = re.compile(r'^RAM\[(\d+)\]$')
+
+    def __init__(self, rom_path):
+        self.emulator = HackEmulator.from_file(rom_path)
+        self.time = 0
+
+    def set(self, name, value):
+        value = ((value + 0x8000) & 0xFFFF) - 0x8000
+        match = self.RAM_PATTERN.match(name)
+        if match is not None:
+            self.emulator.ram[int(match.group(1))] = value
+        elif name in ('A', 'D'):
+            setattr(self.emulator, name.lower(), value)
+        elif name == 'PC':
+            self.emulator.pc = value & 0x7FFF
+            self.emulator.halted = False
+        else:
+            raise TestScriptError(f'unknown CPU emulator variable {name}')
+
+    def get(self, name):
+        if name == 'time':
+            return str(self.time), None
+        match = self.RAM_PATTERN.match(name)
+        if match is not None:
+            return self.emulator.ram[int(match.group(1))] & 0xFFFF, 16
+        if name in ('A', 'D'):
+            return getattr(self.emulator, name.lower()) & 0xFFFF, 16
+        if name == 'PC':
+            return self.emulator.pc, 15
+        raise TestScriptError(f'unknown CPU emulator variable {name}')
+
+    def ticktock(self):
+        emulator = self.emulator
+        emulator.halted = False
+        emulator.run(1)
+        if emulator.halted:
+            # this step reached the (END) loop's jump: run stops in front of it, the jump itself still happens.
+            emulator.pc = emulator.a & 0x7FFF
+        self.time += 1
+
+    def eval(self):
+        pass
+
+
+class ScriptRun:
+    """
+    Executes one .tst script. Output lines are compared against the .cmp file as they are produced,
+    the run stops at the first mismatch. `repeat {` without a count runs until the CPU emulator halts,
+    or max_cycles.
+    """
+    def __init__(self, tst_path, library=None, cache=None, write_out=False, max_cycles=10_000_000):
+        self.tst_path = tst_path
+        self.dir = os.path.dirname(os.path.abspath(tst_path))
+        self.library = library
+        self.cache = cache
+        self.write_out = write_out
+        self.max_cycles = max_cycles
+        self.target = None
+        self.columns = []
+        self.cmp_file = None
+        self.out_file = None
+        self.n_lines = 0
+
+    def _path(self, name):
+        path = os.path.join(self.dir, name)
+        if not os.path.exists(path) and path.endswith('.hack') and os.path.exists(path[:-5] + '.asm'):
+            return path[:-5] + '.asm'  # .hack files are build outputs, assemble the source instead.
+        return path
+
+    def _load(self, name):
+        path = self._path(name)
+        if path.endswith('.hdl'):
+            self.target = ChipTarget(path, self.library or HDLLibrary(), self.cache)
+        else:
+            self.target = CPUTarget(path)
+
+    def _emit(self, line):
+        # streaming compare: returns a mismatch message or None.
+        self.n_lines += 1
+        if self.out_file is not None:
+            self.out_file.write(line + '\n')
+        if self.cmp_file is None:
+            return None
+        expected = self.cmp_file.readline()
+        if not expected:
+            return f'line {self.n_lines}: output is longer than {os.path.basename(self.cmp_file.name)}'
+        if line.rstrip() != expected.rstrip('\r\n').rstrip():
+            return f'line {self.n_lines}: expected {expected.rstrip()!r}, got {line!r}'
+        return None
+
+    def _output(self):
+        cells = []
+        for column in self.columns:
+            value, bits = self.target.get(column.name)
+            cells.append(column.cell(value, bits))
+        return self._emit('|' + '|'.join(cells) + '|')
+
+    def _execute(self, commands):
+        for command in commands:
+            name = command[0]
+            error = None
+            if name == 'load':
+                self._load(command[1])
+            elif name == 'output-file':
+                if self.write_out:
+                    self.out_file = open(self._path(command[1]), 'w')
+            elif name == 'compare-to':
+                self.cmp_file = open(self._path(command[1]), 'r')
+            elif name == 'output-list':
+                self.columns = command[1]
+                error = self._emit('|' + '|'.join(column.header() for column in self.columns) + '|')
+            elif name == 'set':
+                self.target.set(command[1], command[2])
+            elif name == 'output':
+                error = self._output()
+            elif name == 'rom-load':
+                self.target.simulator.models_of('ROM32K')[0].load(HackEmulator.load_rom(self._path(command[1])))
+            elif name == 'repeat':
+                count = command[1]
+                cycles = 0
+                while count is None or cycles < count:
+                    error = self._execute(command[2])
+                    cycles += 1
+                    if error is not None or (count is None and self._stopped(cycles)):
+                        break
+            elif name != 'skip':
+                getattr(self.target, name.replace('-', '_'))()
+            if error is not None:
+                return error
+        return None
+
+    def _stopped(self, cycles):
+        if cycles >= self.max_cycles:
+            return True
+        return isinstance(self.target, CPUTarget) and self.target.emulator.halted
+
+    def run(self):
+        """
+        Returns None when the script passes, otherwise the first mismatch or error.
+        """
+        commands = TestScriptParser().parse_file(self.tst_path)
+        try:
+            error = self._execute(commands)
+            if error is None and self.cmp_file is not None and self.cmp_file.readline().strip():
+                error = f'line {self.n_lines + 1}: output ended before {os.path.basename(self.cmp_file.name)}'
+            return error
+        finally:
+            for f in (self.cmp_file, self.out_file):
+                if f is not None:
+                    f.close()
+
+
+class TestRunner:
+    """
+    Runs .tst scripts over a process pool, one script per job.
+    Results are (path, error or None, output lines compared, seconds), in sorted path order.
+    """
+    def __init__(self, workers=None, cache_dir=None, write_out=False):
+        self.workers = workers or os.cpu_count() or 1
+        self.cache_dir = cache_dir
+        self.write_out = write_out
+
+    @staticmethod
+    def expand_paths(dirs_or_globs):
+        paths = set()
+        for pattern in dirs_or_globs:
+            if os.path.isdir(pattern):
+                pattern = os.path.join(pattern, '*.tst')
+            paths.update(path for path in glob(pattern) if path.endswith('.tst'))
+        return sorted(paths)
+
+    @staticmethod
+    def _run_one(job):
+        tst_path, cache_dir, write_out = job
+        cache = BuildCache(cache_dir) if cache_dir else None
+        start_time = time.perf_counter()
+        script_run = ScriptRun(tst_path, cache=cache, write_out=write_out)
+        try:
+            error = script_run.run()
+        except Exception as e:
+            error = f'{type(e).__name__}: {e}'
+        return tst_path, error, script_run.n_lines, time.perf_counter() - start_time
+
+    def run(self, dirs_or_globs):
+        jobs = [(path, self.cache_dir, self.write_out) for path in self.expand_paths(dirs_or_globs)]
+        if self.workers == 1 or len(jobs) <= 1:
+            return [self._run_one(job) for job in jobs]
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            return list(executor.map(self._run_one, jobs))
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description='Run .tst scripts against the HDL simulator / Hack emulator.')
+    arg_parser.add_argument('paths', nargs='*', help='.tst files, directories or glob patterns (default: chapters)')
+    arg_parser.add_argument('-j', '--workers', type=int, default=None, help='number of processes (default: cpu count)')
+    arg_parser.add_argument('--cache-dir', default=None, help='keep optimized netlists in this build cache')
+    arg_parser.add_argument('--write-out', action='store_true', help='also write the .out files the scripts name')
+    args = arg_parser.parse_args(argv)
+
+    start_time = time.perf_counter()
+    results = TestRunner(args.workers, args.cache_dir, args.write_out).run(args.paths or SCRIPT_DIRS)
+    n_failed = 0
+    for path, error, n_lines, elapsed in results:
+        status = 'ok' if error is None else f'FAIL {error}'
+        print(f'{os.path.relpath(path)}: {n_lines} lines, {elapsed:.2f}s, {status}')
+        n_failed += error is not None
+    elapsed = time.perf_counter() - start_time
+    print(f'{len(results) - n_failed} passed, {n_failed} failed, {elapsed:.2f}s')
+    return 1 if n_failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
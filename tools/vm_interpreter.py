@@ -0,0 +1,285 @@
+import argparse
+import os
+import sys
+import time
+from array import array
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, '07_VM_Translator'))
+from vm_translator import Parser, VMtranslator  # noqa: E402
+
+
+class VMInterpreter:
+    """
+    Executes VM commands (Parser output) directly, without translating to Hack.
+
+    Commands are decoded once into (op, x, y) tuples with everything resolved to ints:
+    labels and functions to command indices, static / temp / pointer to RAM addresses,
+    local / argument / this / that to their base pointer address.
+    RAM layout and command semantics follow the Translator templates:
+        - stack at SP = 256, segments through LCL / ARG / THIS / THAT, temp at 5, statics from 16
+          in order of first use (the order the assembler allocates them in).
+        - 16 bit wrap around arithmetic, eq / gt / lt compare the wrapped difference x - y.
+        - call / function / return build the same frames, but the saved return address is the number
+          of the call site (self.return_addresses maps it back to a command index), which fits a
+          16 bit word however long the program is. R13-R15 are not used.
+        - without bootstrapping, pointers start as SP 256, LCL 300, ARG 400, THIS 3000, THAT 3010.
+    label X / goto X (a jump to itself) is treated as the halt loop.
+    """
+    RAM_SIZE = 32768
+    STATIC_BASE = 16
+    TEMP_BASE = 5
+    POINTER_BASE = 3
+    SEGMENT_POINTERS = {'local': 1, 'argument': 2, 'this': 3, 'that': 4}
+
+    (PUSH_CONSTANT, PUSH_SEGMENT, PUSH_FIXED, POP_SEGMENT, POP_FIXED,
+     ADD, SUB, NEG, EQ, GT, LT, AND, OR, NOT,
+     GOTO, IF_GOTO, CALL, FUNCTION, RETURN, HALT) = range(20)
+
+    ARITHMETIC_OPS = {
+        'add': ADD, 'sub': SUB, 'neg': NEG, 'eq': EQ, 'gt': GT, 'lt': LT, 'and': AND, 'or': OR, 'not': NOT,
+    }
+
+    def __init__(self, dir_or_path, include_bootstrapping=True):
+        self.include_bootstrapping = include_bootstrapping
+        self.static_addresses = {}  # (file name, index) -> RAM address
+        self.program = self._decode(self._read_program(dir_or_path))
+        self.ram = array('h', bytes(2 * self.RAM_SIZE))
+        self.steps = 0
+        self.reset()
+
+    @staticmethod
+    def _read_program(dir_or_path):
+        parser = Parser()
+        return [
+            (VMtranslator._get_file_name(path), VMtranslator._read_commands(path, parser))
+            for path in VMtranslator._get_file_paths(dir_or_path)
+        ]
+
+    def _static_address(self, file_name, index):
+        key = file_name, index
+        if key not in self.static_addresses:
+            self.static_addresses[key] = self.STATIC_BASE + len(self.static_addresses)
+        return self.static_addresses[key]
+
+    def _decode_memory_op(self, op_code, segment, index, file_name):
+        if segment == 'constant':
+            assert op_code == 'push'
+            return self.PUSH_CONSTANT, index, None
+        if segment in self.SEGMENT_POINTERS:
+            op = self.PUSH_SEGMENT if op_code == 'push' else self.POP_SEGMENT
+            return op, self.SEGMENT_POINTERS[segment], index
+        if segment == 'static':
+            address = self._static_address(file_name, index)
+        elif segment == 'temp':
+            address = self.TEMP_BASE + index
+        elif segment == 'pointer':
+            address = self.POINTER_BASE if index == 0 else self.POINTER_BASE + 1
+        else:
+            raise NotImplementedError(f"memory segment [{segment}] is not defined in memory operation.")
+        return (self.PUSH_FIXED if op_code == 'push' else self.POP_FIXED), address, None
+
+    def _decode(self, program):
+        # first pass: command index of every label / function, labels themselves take no slot.
+        targets = {}
+        n_commands = 0
+        for file_name, commands in program:
+            for op_code, arg1, arg2 in commands:
+                if op_code == 'label':
+                    targets[arg1] = n_commands
+                else:
+                    if op_code == 'function':
+                        targets[arg1] = n_commands
+                    n_commands += 1
+
+        def resolve(label):
+            if label not in targets:
+                raise ValueError(f'undefined label or function: {label}')
+            return targets[label]
+
+        decoded = []
+        offset = 0
+        if self.include_bootstrapping:
+            # call Sys.init 0, returning into the first command like the bootstrap code does
+            offset = 1
+            decoded.append((self.CALL, resolve('Sys.init') + offset, 0))
+        for file_name, commands in program:
+            for op_code, arg1, arg2 in commands:
+                if op_code in ('push', 'pop'):
+                    decoded.append(self._decode_memory_op(op_code, arg1, arg2, file_name))
+                elif op_code in self.ARITHMETIC_OPS:
+                    decoded.append((self.ARITHMETIC_OPS[op_code], None, None))
+                elif op_code == 'goto':
+                    target = resolve(arg1) + offset
+                    op = self.HALT if target == len(decoded) else self.GOTO
+                    decoded.append((op, target, None))
+                elif op_code == 'if-goto':
+                    decoded.append((self.IF_GOTO, resolve(arg1) + offset, None))
+                elif op_code == 'call':
+                    decoded.append((self.CALL, resolve(arg1) + offset, arg2))
+                elif op_code == 'function':
+                    decoded.append((self.FUNCTION, arg2, None))
+                elif op_code == 'return':
+                    decoded.append((self.RETURN, None, None))
+                elif op_code != 'label':
+                    raise NotImplementedError(f'op_code {op_code} is not implemented')
+
+        # call site number -> command index to return to, numbers are stored as signed 16 bit words
+        self.return_addresses = [idx + 1 for idx, (op, _, _) in enumerate(decoded) if op == self.CALL]
+        if len(self.return_addresses) > 0x10000:
+            raise ValueError(f'{len(self.return_addresses)} call sites, at most 65536 fit a return address')
+        self._return_ids = {
+            address: ((number + 0x8000) & 0xFFFF) - 0x8000 for number, address in enumerate(self.return_addresses)
+        }
+        return decoded
+
+    def reset(self):
+        ram = self.ram
+        ram[0] = 256
+        self.pc = 0
+        self.halted = False
+        if not self.include_bootstrapping:
+            ram[1], ram[2], ram[3], ram[4] = 300, 400, 3000, 3010
+
+    def run(self, max_steps=None):
+        """
+        Execute at most max_steps commands (no limit if None), stops early on the halt loop
+        or when running off the end of the program. Returns the number of commands executed.
+        """
+        program = self.program
+        ram = self.ram
+        return_addresses = self.return_addresses
+        return_ids = self._return_ids
+        n_commands = len(program)
+        pc = self.pc
+        steps = 0
+        limit = float('inf') if max_steps is None else max_steps
+        while pc < n_commands and steps < limit:
+            op, x, y = program[pc]
+            pc += 1
+            steps += 1
+            if op == 0:  # PUSH_CONSTANT
+                sp = ram[0]
+                ram[sp] = x
+                ram[0] = sp + 1
+            elif op == 1:  # PUSH_SEGMENT
+                sp = ram[0]
+                ram[sp] = ram[(ram[x] + y) & 0x7FFF]
+                ram[0] = sp + 1
+            elif op == 2:  # PUSH_FIXED
+                sp = ram[0]
+                ram[sp] = ram[x]
+                ram[0] = sp + 1
+            elif op == 3:  # POP_SEGMENT
+                sp = ram[0] - 1
+                ram[(ram[x] + y) & 0x7FFF] = ram[sp]
+                ram[0] = sp
+            elif op == 4:  # POP_FIXED
+                sp = ram[0] - 1
+                ram[x] = ram[sp]
+                ram[0] = sp
+            elif op <= 13:  # arithmetic / logic
+                sp = ram[0] - 1
+                value = ram[sp]
+                if op == 7:  # NEG
+                    ram[sp] = ((0x8000 - value) & 0xFFFF) - 0x8000
+                    continue
+                if op == 13:  # NOT
+                    ram[sp] = ~value
+                    continue
+                sp -= 1
+                ram[0] = sp + 1
+                first = ram[sp]
+                if op == 5:  # ADD
+                    value = ((first + value + 0x8000) & 0xFFFF) - 0x8000
+                elif op == 6:  # SUB
+                    value = ((first - value + 0x8000) & 0xFFFF) - 0x8000
+                elif op == 11:  # AND
+                    value = first & value
+                elif op == 12:  # OR
+                    value = first | value
+                else:
+                    difference = ((first - value + 0x8000) & 0xFFFF) - 0x8000
+                    if op == 8:
+                        value = -1 if difference == 0 else 0
+                    elif op == 9:
+                        value = -1 if difference > 0 else 0
+                    else:
+                        value = -1 if difference < 0 else 0
+                ram[sp] = value
+            elif op == 14:  # GOTO
+                pc = x
+            elif op == 15:  # IF_GOTO
+                sp = ram[0] - 1
+                ram[0] = sp
+                if ram[sp]:
+                    pc = x
+            elif op == 16:  # CALL
+                sp = ram[0]
+                ram[sp] = return_ids[pc]
+                ram[sp + 1] = ram[1]
+                ram[sp + 2] = ram[2]
+                ram[sp + 3] = ram[3]
+                ram[sp + 4] = ram[4]
+                sp += 5
+                ram[2] = sp - 5 - y
+                ram[1] = sp
+                ram[0] = sp
+                pc = x
+            elif op == 17:  # FUNCTION
+                sp = ram[0]
+                for offset in range(x):
+                    ram[sp + offset] = 0
+                ram[0] = sp + x
+            elif op == 18:  # RETURN
+                frame = ram[1]
+                return_address = return_addresses[ram[frame - 5] & 0xFFFF]
+                arg = ram[2]
+                ram[arg] = ram[ram[0] - 1]
+                ram[0] = arg + 1
+                ram[4] = ram[frame - 1]
+                ram[3] = ram[frame - 2]
+                ram[2] = ram[frame - 3]
+                ram[1] = ram[frame - 4]
+                pc = return_address
+            else:  # HALT
+                pc -= 1
+                self.halted = True
+                break
+
+        self.pc = pc
+        self.steps += steps
+        return steps
+
+
+def _parse_assignment(text):
+    address, value = text.split('=')
+    return int(address), int(value)
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description='Run .vm programs directly, without translating them.')
+    arg_parser.add_argument('path', help='.vm file or directory of .vm files')
+    arg_parser.add_argument('--no-bootstrap', action='store_true', help="don't call Sys.init on start")
+    arg_parser.add_argument('--steps', type=int, default=None, help='VM command budget')
+    arg_parser.add_argument('--set', action='append', default=[], type=_parse_assignment,
+                            metavar='ADDRESS=VALUE', help='initial RAM value (repeatable)')
+    arg_parser.add_argument('--dump', default='0:16', help='RAM range to print afterwards, start:end')
+    args = arg_parser.parse_args(argv)
+
+    interpreter = VMInterpreter(args.path, include_bootstrapping=not args.no_bootstrap)
+    for address, value in args.set:
+        interpreter.ram[address] = value
+    start_time = time.perf_counter()
+    steps = interpreter.run(args.steps)
+    elapsed = time.perf_counter() - start_time
+
+    start, end = (int(n) for n in args.dump.split(':'))
+    for address in range(start, end):
+        print(f'RAM[{address}] = {interpreter.ram[address]}')
+    status = 'halted' if interpreter.halted else f'stopped at command {interpreter.pc}'
+    print(f'{steps} commands, {status}, {steps / max(elapsed, 1e-9) / 1e6:.2f}M commands/sec')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,121 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+from array import array
+from bisect import bisect_right
+from collections import Counter
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from hack_emulator import HackEmulator  # noqa: E402
+from vm_to_hack import VMToHack  # noqa: E402
+
+
+class VMProfiler:
+    """
+    Attributes per ROM address instruction counts (HackEmulator.run(counts=...)) back to VM code,
+    through the VM translator's source map (VM command -> asm lines)
+    and the assembler's (asm line -> ROM address).
+    Code that belongs to no VM command (bootstrap, shared runtime routines) is reported
+    under the nearest label before it, in parentheses.
+    """
+    def __init__(self, vm_map, asm_map):
+        self.commands = vm_map['commands']
+        address_of_line = {line: address for line, address in asm_map['lines']}
+        self.command_of_address = {}
+        for idx, command in enumerate(self.commands):
+            first, last = command['asm_lines']
+            for line in range(first, last + 1):
+                if line in address_of_line:
+                    self.command_of_address[address_of_line[line]] = idx
+        labels = sorted((address, label) for label, address in asm_map['labels'].items())
+        self.label_addresses = [address for address, _ in labels]
+        self.label_names = [label for _, label in labels]
+
+    @classmethod
+    def from_files(cls, vm_map_path, asm_map_path):
+        with open(vm_map_path, 'r') as rf:
+            vm_map = json.load(rf)
+        with open(asm_map_path, 'r') as rf:
+            asm_map = json.load(rf)
+        return cls(vm_map, asm_map)
+
+    def _unmapped_name(self, address):
+        idx = bisect_right(self.label_addresses, address) - 1
+        return f'({self.label_names[idx]})' if idx >= 0 else '(bootstrap)'
+
+    def profile(self, counts):
+        """
+        Returns (by_function, by_command), Counters of instructions executed.
+            by_function: function name (or unmapped label) -> count
+            by_command: index into self.commands (or unmapped label) -> count
+        """
+        by_function = Counter()
+        by_command = Counter()
+        for address, count in enumerate(counts):
+            if not count:
+                continue
+            idx = self.command_of_address.get(address)
+            if idx is None:
+                name = self._unmapped_name(address)
+                by_function[name] += count
+                by_command[name] += count
+            else:
+                by_function[self.commands[idx]['function'] or '(top level)'] += count
+                by_command[idx] += count
+        return by_function, by_command
+
+    def _describe_command(self, key):
+        if isinstance(key, str):
+            return key
+        command = self.commands[key]
+        line = '?' if command['line'] is None else command['line']
+        return f"{command['file']}.vm:{line}  {command['command']}"
+
+    def report(self, counts, top=20):
+        by_function, by_command = self.profile(counts)
+        total = sum(by_function.values()) or 1
+        lines = [f'{total} instructions', '', 'by function:']
+        for name, count in by_function.most_common(top):
+            lines.append(f'{count:>12} {100 * count / total:6.2f}%  {name}')
+        lines += ['', 'by VM command:']
+        for key, count in by_command.most_common(top):
+            lines.append(f'{count:>12} {100 * count / total:6.2f}%  {self._describe_command(key)}')
+        return '\n'.join(lines)
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description='Profile a VM program on the Hack emulator.')
+    arg_parser.add_argument('path', help='.vm file or directory of .vm files')
+    arg_parser.add_argument('--no-bootstrap', action='store_true', help="don't call Sys.init on start")
+    arg_parser.add_argument('--cycles', type=int, default=100_000_000, help='cycle budget')
+    arg_parser.add_argument('--top', type=int, default=20, help='rows per table')
+    arg_parser.add_argument('--optimize-vm', action='store_true', help='constant folding on VM commands')
+    arg_parser.add_argument('--stack-caching', action='store_true', help='keep top of the stack in D')
+    arg_parser.add_argument('--shared-runtime', action='store_true', help='shared call / return / comparison code')
+    args = arg_parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        hack_path = os.path.join(tmp_dir, 'program.hack')
+        vm_map_path = os.path.join(tmp_dir, 'program.vm.json')
+        asm_map_path = os.path.join(tmp_dir, 'program.asm.json')
+        VMToHack(args.path, include_bootstrapping=not args.no_bootstrap).build(
+            output_path=hack_path,
+            vm_map_path=vm_map_path,
+            asm_map_path=asm_map_path,
+            optimize_vm=args.optimize_vm,
+            stack_caching=args.stack_caching,
+            shared_runtime=args.shared_runtime,
+        )
+        emulator = HackEmulator.from_file(hack_path)
+        profiler = VMProfiler.from_files(vm_map_path, asm_map_path)
+
+    counts = array('Q', bytes(8 * len(emulator.rom)))
+    emulator.run(args.cycles, counts=counts)
+    print(profiler.report(counts, args.top))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
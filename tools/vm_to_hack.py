@@ -0,0 +1,85 @@
+import argparse
+import io
+import os
+import sys
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.append(os.path.join(ROOT_DIR, '06_Assembler'))
+sys.path.append(os.path.join(ROOT_DIR, '07_VM_Translator'))
+from assembler import Assembler  # noqa: E402
+from vm_translator import VMtranslator  # noqa: E402
+
+
+class VMToHack:
+    """
+    .vm file or directory straight to .hack (and / or packed binary ROM image).
+    VM translator output stays in memory and is fed line by line into the streaming assembler,
+    no intermediate .asm file is written unless asm_path is given.
+    """
+    def __init__(self, dir_or_path, include_bootstrapping=True):
+        self.vm_translator = VMtranslator(dir_or_path, include_bootstrapping)
+        self.hack_path = os.path.splitext(self.vm_translator.save_path)[0] + '.hack'
+
+    def build(self, output_path=None, binary_output_path=None, asm_path=None, vm_map_path=None, asm_map_path=None,
+              **translate_options):
+        """
+        output_path defaults to the .hack next to the VM translator's .asm save path.
+        Pass output_path='' to skip the text output (only binary_output_path is written).
+        vm_map_path / asm_map_path: source maps, VM command -> asm lines and asm line -> ROM address
+            (see VMtranslator.translate and Assembler.build_source_map).
+        translate_options go to VMtranslator.translate (optimize, stack_caching, ...).
+        """
+        if output_path is None:
+            output_path = self.hack_path
+        asm_buffer = io.StringIO()
+        self.vm_translator.translate(
+            print_output=False, output=asm_buffer, source_map_path=vm_map_path, **translate_options
+        )
+        if asm_path is not None:
+            with open(asm_path, 'w') as wf:
+                wf.write(asm_buffer.getvalue())
+
+        asm_buffer.seek(0)
+        Assembler().translate_lines(asm_buffer, output_path or None, binary_output_path, asm_map_path)
+        return self.vm_translator.dropped_functions
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description='Translate .vm files straight into a .hack program.')
+    arg_parser.add_argument('path', help='.vm file or directory of .vm files')
+    arg_parser.add_argument('-o', '--output', default=None, help='.hack output path')
+    arg_parser.add_argument('--binary', default=None, help='also write packed little-endian ROM image here')
+    arg_parser.add_argument('--no-text', action='store_true', help="don't write .hack text (use with --binary)")
+    arg_parser.add_argument('--asm', default=None, help='also keep the intermediate assembly here')
+    arg_parser.add_argument('--vm-map', default=None, help='write VM command -> asm lines source map here')
+    arg_parser.add_argument('--asm-map', default=None, help='write asm line -> ROM address source map here')
+    arg_parser.add_argument('--no-bootstrap', action='store_true', help="don't call Sys.init on start")
+    arg_parser.add_argument('--optimize', action='store_true', help='peephole optimize generated assembly')
+    arg_parser.add_argument('--optimize-vm', action='store_true', help='constant folding on VM commands')
+    arg_parser.add_argument('--stack-caching', action='store_true', help='keep top of the stack in D')
+    arg_parser.add_argument('--shared-runtime', action='store_true', help='shared call / return / comparison code')
+    arg_parser.add_argument('--eliminate-dead-functions', action='store_true', help='drop unreachable functions')
+    arg_parser.add_argument('--inline-threshold', type=int, default=None, help='inline leaf functions up to this size')
+    arg_parser.add_argument('-j', '--workers', type=int, default=1, help='translate files in this many processes')
+    args = arg_parser.parse_args(argv)
+
+    pipeline = VMToHack(args.path, include_bootstrapping=not args.no_bootstrap)
+    pipeline.build(
+        output_path='' if args.no_text else args.output,
+        binary_output_path=args.binary,
+        asm_path=args.asm,
+        vm_map_path=args.vm_map,
+        asm_map_path=args.asm_map,
+        optimize=args.optimize,
+        optimize_vm=args.optimize_vm,
+        stack_caching=args.stack_caching,
+        shared_runtime=args.shared_runtime,
+        eliminate_dead_functions=args.eliminate_dead_functions,
+        inline_threshold=args.inline_threshold,
+        workers=args.workers,
+    )
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())